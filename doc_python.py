@@ -1,8 +1,22 @@
 import os
 import sys
 import datetime
+import hashlib
+import html
+import io
+import json
+import shutil
+import subprocess
+import tarfile
+import threading
 import time
 import traceback
+import tracemalloc
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
 from io import BytesIO
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -15,6 +29,7 @@ from reportlab.platypus import (
     BaseDocTemplate, PageTemplate, Frame, Paragraph, Spacer, PageBreak
 )
 from reportlab.lib import colors
+from reportlab.platypus.paragraph import split as split_paragraph_words
 
 # Cấu hình lọc file
 VALID_EXTENSIONS = ['.cs', '.cshtml', '.dart']
@@ -37,6 +52,25 @@ PRIORITY_DIRS = ['src', 'app', 'source', 'lib', 'components', 'controllers', 'mo
 MAX_LINES_PER_FILE = 10000
 MAX_FILES_TO_PROCESS = 500  # Giới hạn số file tối đa
 PAGES_PER_SECTION = 25  # Số trang mỗi phần (đầu, giữa, cuối)
+CODE_BATCH_SIZE = 20  # Số dòng code gộp vào một Paragraph
+
+# Bố cục trang (dùng chung cho mọi lần build và cho ước lượng số trang)
+PAGE_MARGIN_X = 15 * mm
+PAGE_MARGIN_Y = 25 * mm
+FOOTER_HEIGHT = 20 * mm  # Khoảng trống dành cho footer phía dưới frame
+FRAME_PADDING = 6  # Padding mặc định của reportlab Frame
+
+# Checkpoint cho chế độ build có thể tiếp tục
+CHECKPOINT_DIR_NAME = '.pdf_checkpoint'  # Thư mục làm việc, tạo trong thư mục source
+CHECKPOINT_VERSION = 2
+CHECKPOINT_SHARD_FILES = 16  # Số file trung bình mỗi shard checkpoint (các file chung một bản font nhúng)
+MEMORY_REPORT_NAME = 'SourceCode_MemoryReport.json'  # Báo cáo khi bật đo bộ nhớ
+WATCH_INTERVAL = 1.0  # Chu kỳ kiểm tra thay đổi (giây) ở watch mode
+LINEARIZE_BENCH_RATE = 8 * 1024 * 1024  # Tốc độ đọc giả lập file share (bytes/s) khi đo trang đầu
+LINEARIZE_BENCH_LATENCY = 0.002  # Độ trễ mỗi lần tải block (giây) của file share giả lập
+VOLUME_FILE_PATTERN = 'SourceCode_Vol{:02d}.pdf'
+VOLUME_MANIFEST_NAME = 'SourceCode_Volumes.json'
+MAX_VOLUME_WORKERS = 4  # Số volume ghi song song
 
 # Màu sắc cho console output
 class Colors:
@@ -93,6 +127,265 @@ def log_section(title):
     print(f"{Colors.HEADER}{title.center(60)}{Colors.ENDC}")
     print(f"{Colors.HEADER}{'='*60}{Colors.ENDC}")
 
+class MemoryBudgetExceeded(Exception):
+    """Vượt giới hạn bộ nhớ đã cấu hình"""
+
+
+class MemoryProfiler:
+    """
+    Đo bộ nhớ theo từng bước / từng file bằng lấy mẫu RSS.
+    use_tracemalloc=True đo thêm chi tiết cấp phát Python (chậm hơn nhiều lần)
+    """
+
+    def __init__(self, report_path, budget_mb=None, use_tracemalloc=False, sample_interval=0.1):
+        self.report_path = report_path
+        self.use_tracemalloc = use_tracemalloc
+        self.budget_bytes = int(budget_mb * 1024 * 1024) if budget_mb else None
+        self.sample_interval = sample_interval
+        self.records = []
+        self.aborted_reason = None
+        self._stack = []
+        self._rss_current = None
+        self._rss_peak = 0
+        self._stop_event = threading.Event()
+        self._sampler = None
+        self._started_at = None
+
+    def start(self):
+        if self.use_tracemalloc:
+            tracemalloc.start()
+        self._started_at = time.time()
+        self._rss_current = get_rss_bytes()
+        self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+        self._sampler.start()
+        log_info("Đã bật đo bộ nhớ (" + ("tracemalloc + RSS" if self.use_tracemalloc else "RSS") + ")")
+        if self.budget_bytes:
+            log_info(f"Giới hạn bộ nhớ: {self.budget_bytes / (1024 * 1024):.0f} MB", 1)
+
+    def stop(self):
+        self._stop_event.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1)
+
+    def _update_rss(self):
+        rss = get_rss_bytes()
+        if rss is not None:
+            self._rss_current = rss
+            self._rss_peak = max(self._rss_peak, rss)
+            for frame in self._stack:
+                frame['rss_peak'] = max(frame['rss_peak'], rss)
+        return rss
+
+    def _sample_rss(self):
+        while not self._stop_event.wait(self.sample_interval):
+            if self._update_rss() is None:
+                return
+
+    def _read_memory(self):
+        """(current, peak) theo tracemalloc, hoặc theo RSS nếu không dùng tracemalloc"""
+        rss = self._update_rss() or 0
+        if self.use_tracemalloc:
+            return tracemalloc.get_traced_memory()
+        return rss, rss
+
+    @contextmanager
+    def stage(self, name, kind='stage'):
+        current, peak = self._read_memory()
+        # Giữ lại đỉnh của các bước cha trước khi reset để bước con đo riêng
+        for parent in self._stack:
+            parent['peak'] = max(parent['peak'], peak)
+        if self.use_tracemalloc:
+            tracemalloc.reset_peak()
+
+        frame = {
+            'name': name,
+            'kind': kind,
+            'start_current': current,
+            'peak': current,
+            'rss_before': self._rss_current,
+            'rss_peak': self._rss_current or 0,
+            'start_time': time.time()
+        }
+        self._stack.append(frame)
+        try:
+            # Kiểm tra trong try để bước bị dừng vẫn được pop khỏi stack và ghi vào báo cáo
+            self.check_budget()
+            yield
+        finally:
+            current, peak = self._read_memory()
+            self._stack.pop()
+            if not self.use_tracemalloc:
+                peak = frame['rss_peak']
+            frame['peak'] = max(frame['peak'], peak)
+            for parent in self._stack:
+                parent['peak'] = max(parent['peak'], frame['peak'])
+                parent['rss_peak'] = max(parent['rss_peak'], frame['rss_peak'])
+
+            self.records.append({
+                'name': name,
+                'kind': kind,
+                'parent': self._stack[-1]['name'] if self._stack else None,
+                'seconds': round(time.time() - frame['start_time'], 3),
+                'net_bytes': current - frame['start_current'],
+                'peak_bytes': frame['peak'] - frame['start_current'],
+                'peak_absolute_bytes': frame['peak'],
+                'rss_before_bytes': frame['rss_before'],
+                'rss_after_bytes': self._rss_current,
+                'rss_peak_bytes': frame['rss_peak'] or None
+            })
+
+    def check_budget(self):
+        if not self.budget_bytes or self.aborted_reason:
+            return
+        used = self._rss_current
+        if used is None and self.use_tracemalloc:
+            used = tracemalloc.get_traced_memory()[0]
+        if used is None:
+            return
+        if used > self.budget_bytes:
+            where = self._stack[-1]['name'] if self._stack else 'main'
+            self.aborted_reason = (f"Vượt giới hạn bộ nhớ {self.budget_bytes / (1024 * 1024):.0f} MB "
+                                   f"({used / (1024 * 1024):.0f} MB) tại: {where}")
+            raise MemoryBudgetExceeded(self.aborted_reason)
+
+    def build_report(self, top_n=10):
+        def top(kind):
+            items = [r for r in self.records if r['kind'] == kind]
+            # Một file có thể được xử lý nhiều lần (đếm trang + render) → giữ lần nặng nhất
+            heaviest = {}
+            for r in items:
+                if r['name'] not in heaviest or r['peak_bytes'] > heaviest[r['name']]['peak_bytes']:
+                    heaviest[r['name']] = r
+            return sorted(heaviest.values(), key=lambda r: r['peak_bytes'], reverse=True)[:top_n]
+
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        allocation_sites = []
+        if snapshot is not None:
+            for stat in snapshot.statistics('lineno')[:top_n]:
+                frame = stat.traceback[0]
+                allocation_sites.append({
+                    'location': f"{frame.filename}:{frame.lineno}",
+                    'size_bytes': stat.size,
+                    'count': stat.count
+                })
+
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+        return {
+            'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'mode': 'tracemalloc+rss' if self.use_tracemalloc else 'rss',
+            'elapsed_seconds': round(time.time() - self._started_at, 3) if self._started_at else None,
+            'budget_bytes': self.budget_bytes,
+            'aborted': self.aborted_reason is not None,
+            'aborted_reason': self.aborted_reason,
+            'traced_current_bytes': current,
+            'traced_peak_bytes': peak,
+            'rss_peak_bytes': self._rss_peak or None,
+            'stages': [r for r in self.records if r['kind'] == 'stage'],
+            'top_files': top('file'),
+            'top_allocation_sites': allocation_sites
+        }
+
+    def finish(self):
+        """Dừng lấy mẫu và ghi báo cáo JSON"""
+        self.stop()
+        self.write_report(self.report_path)
+        if self.use_tracemalloc:
+            tracemalloc.stop()
+
+    def write_report(self, output_path):
+        report = self.build_report()
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        log_section("BÁO CÁO BỘ NHỚ")
+        for r in report['stages']:
+            log_info(f"• {r['name']}: peak +{r['peak_bytes'] / (1024 * 1024):.1f} MB, "
+                     f"net {r['net_bytes'] / (1024 * 1024):+.1f} MB ({r['seconds']:.1f}s)", 1)
+        if report['top_files']:
+            log_info("File tốn bộ nhớ nhất:")
+            for r in report['top_files'][:5]:
+                log_info(f"• {r['name']}: peak +{r['peak_bytes'] / (1024 * 1024):.1f} MB ({r['parent']})", 1)
+        if report['rss_peak_bytes']:
+            log_info(f"RSS cao nhất: {report['rss_peak_bytes'] / (1024 * 1024):.0f} MB")
+        log_success(f"Đã lưu báo cáo bộ nhớ: {output_path}")
+
+
+# Profiler đang bật (None = không đo)
+memory_profiler = None
+
+
+def get_rss_bytes():
+    """RSS hiện tại của process (psutil nếu có, nếu không đọc /proc), None nếu không đo được"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def memory_stage(name, kind='stage'):
+    """Context đo bộ nhớ cho một bước (không làm gì nếu chưa bật đo)"""
+    if memory_profiler is None:
+        return nullcontext()
+    return memory_profiler.stage(name, kind)
+
+
+@contextmanager
+def memory_build_stages(doc, directory, story):
+    """
+    Đo bộ nhớ của doc.build theo từng file: layout (wrap/split) diễn ra trong doc.build chứ không phải
+    lúc tạo Paragraph, nên mỗi flowable có _source_path mở một bước 'file' mới cho tới file kế tiếp.
+    doc.build tiêu thụ dần list story: story rỗng nghĩa là file cuối đã xong, phần ghi PDF không tính cho file
+    """
+    if memory_profiler is None:
+        yield
+        return
+
+    previous_hook = doc.afterFlowable
+    current = {'path': None, 'stage': None}
+
+    def close_stage(exc_info=(None, None, None)):
+        if current['stage'] is not None:
+            current['stage'].__exit__(*exc_info)
+            current['stage'] = None
+
+    def after_flowable(flowable):
+        previous_hook(flowable)
+        if not story:
+            close_stage()
+            return
+        path = getattr(flowable, '_source_path', None)
+        if path is None or path == current['path']:
+            return
+        close_stage()
+        current['path'] = path
+        stage = memory_profiler.stage(os.path.relpath(path, directory), 'file')
+        stage.__enter__()
+        current['stage'] = stage
+
+    doc.afterFlowable = after_flowable
+    try:
+        yield
+    except BaseException:
+        close_stage(sys.exc_info())
+        raise
+    else:
+        close_stage()
+    finally:
+        doc.afterFlowable = previous_hook
+
+
+def check_memory_budget():
+    """Dừng sạch sẽ nếu vượt giới hạn bộ nhớ"""
+    if memory_profiler is not None:
+        memory_profiler.check_budget()
+
+
 def register_fonts():
     """Đăng ký font Times New Roman cho tiếng Việt"""
     log_info("Bắt đầu đăng ký fonts...")
@@ -155,6 +448,39 @@ def draw_footer(canvas, doc, page_mapping, total_pages, fontName, is_shortened=F
     canvas.drawRightString(A4[0] - 15 * mm, 15 * mm, f"{original_page}/{total_pages}")
 
 
+def create_doc_template(target, template_id='normal', on_page=None):
+    """Tạo BaseDocTemplate A4 với frame chuẩn"""
+    doc = BaseDocTemplate(
+        target,
+        pagesize=A4,
+        leftMargin=PAGE_MARGIN_X,
+        rightMargin=PAGE_MARGIN_X,
+        topMargin=PAGE_MARGIN_Y,
+        bottomMargin=PAGE_MARGIN_Y
+    )
+
+    frame = Frame(
+        doc.leftMargin,
+        doc.bottomMargin + FOOTER_HEIGHT,
+        doc.width,
+        doc.height - FOOTER_HEIGHT,
+        id='normal'
+    )
+
+    if on_page is not None:
+        doc.addPageTemplates([PageTemplate(id=template_id, frames=frame, onPage=on_page)])
+    else:
+        doc.addPageTemplates([PageTemplate(id=template_id, frames=frame)])
+    return doc
+
+
+def get_frame_content_size():
+    """Kích thước vùng nội dung thực tế trong frame (đã trừ padding)"""
+    width = A4[0] - 2 * PAGE_MARGIN_X - 2 * FRAME_PADDING
+    height = A4[1] - 2 * PAGE_MARGIN_Y - FOOTER_HEIGHT - 2 * FRAME_PADDING
+    return width, height
+
+
 def get_all_code_files(directory):
     log_info("Bắt đầu tìm kiếm file code...")
     start_time = time.time()
@@ -245,6 +571,11 @@ def get_all_code_files(directory):
     log_info(f"File code hợp lệ: {len(code_files)}")
     log_info(f"File bị loại trừ: {excluded_count}")
     
+    return filter_code_files(directory, code_files)
+
+
+def filter_code_files(directory, code_files):
+    """Đề xuất lọc bớt theo thư mục cấp 1 khi có quá nhiều file"""
     # Cảnh báo nếu có quá nhiều file
     if len(code_files) > 100:
         log_warning(f"⚠️ Có {len(code_files)} files - PDF sẽ rất lớn!")
@@ -319,6 +650,264 @@ def get_all_code_files(directory):
     return code_files
 
 
+class SourceArchive:
+    """
+    Đọc file code trực tiếp trong archive .zip/.tar(.gz/.bz2/.xz), không giải nén ra đĩa.
+    Mỗi member được gán một đường dẫn ảo <archive>/<member> để os.path.relpath vẫn dùng được
+    """
+
+    def __init__(self, archive_path):
+        self.archive_path = os.path.abspath(archive_path)
+        self.members = {}  # đường dẫn ảo → member
+        self.sizes = {}    # đường dẫn ảo → kích thước (bytes)
+        self._lock = threading.Lock()
+
+        if zipfile.is_zipfile(self.archive_path):
+            self.kind = 'zip'
+            self._archive = zipfile.ZipFile(self.archive_path)
+            entries = [(info.filename, info.file_size, info)
+                       for info in self._archive.infolist() if not info.is_dir()]
+        else:
+            self.kind = 'tar'
+            self._archive = tarfile.open(self.archive_path, 'r:*')
+            entries = [(member.name, member.size, member)
+                       for member in self._archive.getmembers() if member.isfile()]
+
+        for name, size, member in entries:
+            parts = [part for part in name.split('/') if part not in ('', '.')]
+            if not parts:
+                continue
+            path = os.path.join(self.archive_path, *parts)
+            self.members[path] = member
+            self.sizes[path] = size
+
+    def open(self, path):
+        """
+        Mở member ở chế độ binary. Member hỏng (CRC, dữ liệu nén lỗi, archive bị cắt)
+        được báo bằng OSError như file lỗi trên đĩa
+        """
+        member = self.members[path]
+        try:
+            if self.kind == 'zip':
+                # Zip có central directory nên đọc được ngẫu nhiên từng member; lỗi CRC chỉ lộ ra khi đọc hết
+                with self._archive.open(member) as f:
+                    return BytesIO(f.read())
+
+            # Tar dùng chung một stream: đọc trọn member (< 5MB) vào bộ nhớ dưới lock
+            with self._lock:
+                with self._archive.extractfile(member) as f:
+                    return BytesIO(f.read())
+        except ARCHIVE_READ_ERRORS as e:
+            raise OSError(f"Member lỗi trong archive: {os.path.relpath(path, self.archive_path)} ({e})") from e
+
+    def close(self):
+        self._archive.close()
+
+
+# Archive đang dùng làm input (None = đọc thư mục trên đĩa)
+source_archive = None
+# Lỗi đọc archive hỏng không thuộc OSError
+ARCHIVE_READ_ERRORS = (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError, NotImplementedError)
+
+
+def is_source_archive(path):
+    """Kiểm tra path có phải archive .zip/.tar đọc được không"""
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def open_source_file(path):
+    """Mở file code ở chế độ binary (file trên đĩa hoặc member trong archive)"""
+    if source_archive is not None and path in source_archive.members:
+        return source_archive.open(path)
+    return open(path, 'rb')
+
+
+def read_source_text(path):
+    """Đọc toàn bộ dòng của file code (utf-8, bỏ qua byte lỗi)"""
+    with io.TextIOWrapper(open_source_file(path), encoding='utf-8', errors='ignore') as f:
+        return f.readlines()
+
+
+def get_source_size(path):
+    """Kích thước file code (bytes)"""
+    if source_archive is not None and path in source_archive.members:
+        return source_archive.sizes[path]
+    return os.path.getsize(path)
+
+
+def get_archive_code_files(archive):
+    """Liệt kê và lọc file code trong archive theo VALID_EXTENSIONS / EXCLUDED_DIRS / EXCLUDED_PATTERNS"""
+    log_info(f"Bắt đầu tìm kiếm file code trong archive ({archive.kind})...")
+    start_time = time.time()
+
+    code_files = []
+    excluded_count = 0
+
+    for path, file_size in archive.sizes.items():
+        member_path = os.path.relpath(path, archive.archive_path)
+        file = os.path.basename(member_path)
+        ext = os.path.splitext(file)[1].lower()
+        if ext not in VALID_EXTENSIONS:
+            continue
+
+        if any(p.lower() in member_path.lower() for p in EXCLUDED_DIRS):
+            excluded_count += 1
+            continue
+
+        if any(p.lower() in file.lower() for p in EXCLUDED_PATTERNS):
+            excluded_count += 1
+            if len(code_files) < 50:  # Chỉ log 50 file đầu
+                log_info(f"Bỏ qua (pattern): {member_path}", 3)
+            continue
+
+        if file_size >= 5 * 1024 * 1024:  # >= 5MB
+            if len(code_files) < 20:
+                log_warning(f"File quá lớn (>5MB): {member_path}", 3)
+            excluded_count += 1
+            continue
+
+        code_files.append(path)
+        if len(code_files) <= 20:  # Chỉ log chi tiết 20 file đầu
+            log_info(f"✓ {member_path} ({file_size/1024:.1f} KB)", 3)
+
+        if len(code_files) >= MAX_FILES_TO_PROCESS:
+            log_warning(f"⚠️ Đã đạt giới hạn {MAX_FILES_TO_PROCESS} files!")
+            log_warning("Dừng tìm kiếm để tránh xử lý quá lâu")
+            break
+
+    elapsed = time.time() - start_time
+    log_success(f"Hoàn thành tìm kiếm ({elapsed:.2f}s)")
+    log_info(f"Tổng file trong archive: {len(archive.members)}")
+    log_info(f"File code hợp lệ: {len(code_files)}")
+    log_info(f"File bị loại trừ: {excluded_count}")
+
+    return filter_code_files(archive.archive_path, code_files)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Hash nhanh nội dung file (blake2b)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open_source_file(path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_duplicate_files(code_files):
+    """
+    Tìm các file trùng nội dung byte-by-byte.
+    Trả về dict {file trùng: file gốc} với file gốc là bản xuất hiện đầu tiên
+    """
+    log_info("Đang kiểm tra file trùng nội dung...")
+    start_time = time.time()
+
+    # Lọc theo kích thước trước để không phải đọc các file có kích thước duy nhất
+    by_size = {}
+    for path in code_files:
+        try:
+            size = get_source_size(path)
+        except OSError:
+            continue
+        if size > 0:
+            by_size.setdefault(size, []).append(path)
+
+    duplicates = {}
+    hashed_count = 0
+    for paths in by_size.values():
+        if len(paths) < 2:
+            continue
+
+        originals = {}
+        for path in paths:
+            try:
+                digest = hash_file(path)
+            except OSError as e:
+                log_warning(f"Không thể hash file {path}: {e}", 1)
+                continue
+            hashed_count += 1
+            if digest in originals:
+                duplicates[path] = originals[digest]
+            else:
+                originals[digest] = path
+
+    elapsed = time.time() - start_time
+    log_success(f"Hoàn thành kiểm tra trùng lặp ({elapsed:.2f}s)")
+    log_info(f"Đã hash {hashed_count}/{len(code_files)} files (cùng kích thước)", 1)
+    if duplicates:
+        log_info(f"Tìm thấy {len(duplicates)} file trùng nội dung → chỉ in 1 lần", 1)
+    return duplicates
+
+
+def report_duplicates(directory, duplicates, page_counts, seconds_per_page=0):
+    """Báo cáo số trang và thời gian tiết kiệm được nhờ bỏ file trùng"""
+    if not duplicates:
+        return
+
+    log_section("BÁO CÁO FILE TRÙNG LẶP")
+    pages_saved = 0
+    for path, original in duplicates.items():
+        original_pages = page_counts.get(original)
+        saved = max(original_pages - 1, 0) if original_pages else 0
+        pages_saved += saved
+        log_info(f"• {os.path.relpath(path, directory)} = {os.path.relpath(original, directory)} "
+                 f"(-{saved} trang)", 1)
+
+    log_info(f"Số file trùng: {len(duplicates)}")
+    log_success(f"Tiết kiệm: ~{pages_saved} trang, ~{pages_saved * seconds_per_page:.1f}s render")
+
+
+def clean_code_line(line):
+    """Làm sạch một dòng code (chưa escape markup)"""
+    return line.rstrip().replace('\x00', '').replace('\ufffd', '?')
+
+
+def format_code_line(line, line_no):
+    """Dòng hiển thị dạng text thuần: số dòng + nội dung"""
+    return f"{line_no:03} | {clean_code_line(line)}"
+
+
+def format_code_batch(batch, first_line_no):
+    """Tạo markup Paragraph cho một nhóm dòng code"""
+    content = ""
+    for idx, line in enumerate(batch, start=first_line_no):
+        clean = clean_code_line(line)
+        clean = clean.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        clean = clean.replace('"', '&quot;').replace("'", '&apos;')
+        content += f"{idx:03} | {clean}<br/>"
+    return content
+
+
+def create_styles(fontName):
+    """Tạo các style dùng cho nội dung PDF"""
+    styles = getSampleStyleSheet()
+
+    return {
+        'file_heading_style': ParagraphStyle('FileHeading',
+                                            parent=styles['Heading2'],
+                                            fontName=fontName,
+                                            fontSize=14,
+                                            alignment=TA_LEFT,
+                                            spaceAfter=8,
+                                            spaceBefore=12),
+
+        'code_style': ParagraphStyle('Code',
+                                   parent=styles['Normal'],
+                                   fontName=fontName,
+                                   fontSize=12,
+                                   alignment=TA_LEFT,
+                                   spaceAfter=5,
+                                   spaceBefore=0,
+                                   leading=13),
+
+        'info_style': ParagraphStyle('Info',
+                                   parent=styles['Normal'],
+                                   fontName=fontName,
+                                   fontSize=11,
+                                   alignment=TA_LEFT,
+                                   spaceAfter=10)
+    }
+
+
 def build_story_element(path, directory, fontName, styles, file_index=None, total_files=None):
     """Tạo story elements cho một file"""
     code_style = styles['code_style']
@@ -336,8 +925,7 @@ def build_story_element(path, directory, fontName, styles, file_index=None, tota
 
     try:
         start_time = time.time()
-        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
+        lines = read_source_text(path)
         
         log_info(f"  Đọc {len(lines)} dòng ({time.time() - start_time:.2f}s)", 1)
         
@@ -351,7 +939,7 @@ def build_story_element(path, directory, fontName, styles, file_index=None, tota
         log_warning(f"  File bị cắt ngắn, chỉ lấy {MAX_LINES_PER_FILE} dòng đầu", 1)
         elements.append(Paragraph(f"⚠️ File bị cắt ngắn, chỉ hiển thị {MAX_LINES_PER_FILE} dòng đầu", info_style))
 
-    batch_size = 20
+    batch_size = CODE_BATCH_SIZE
     total_batches = (len(lines) + batch_size - 1) // batch_size
     
     for batch_num, start in enumerate(range(0, len(lines), batch_size), 1):
@@ -359,13 +947,7 @@ def build_story_element(path, directory, fontName, styles, file_index=None, tota
             log_info(f"  Processing batch {batch_num}/{total_batches}", 2)
         
         batch = lines[start:start + batch_size]
-        content = ""
-        
-        for idx, line in enumerate(batch, start=start + 1):
-            clean = line.rstrip().replace('\x00', '').replace('\ufffd', '?')
-            clean = clean.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-            clean = clean.replace('"', '&quot;').replace("'", '&apos;')
-            content += f"{idx:03} | {clean}<br/>"
+        content = format_code_batch(batch, start + 1)
         
         if content:
             try:
@@ -379,39 +961,26 @@ def build_story_element(path, directory, fontName, styles, file_index=None, tota
     return elements
 
 
-def build_story(directory, code_files, fontName, file_indices=None):
+def build_duplicate_stub(path, original_path, directory, styles, original_page=None):
+    """Tạo story ngắn cho file trùng nội dung với một file đã in trước đó"""
+    rel_path = os.path.relpath(path, directory)
+    original_rel = os.path.relpath(original_path, directory)
+
+    note = f"♻️ Nội dung giống hệt {original_rel}"
+    if original_page:
+        note += f", trang {original_page}"
+
+    heading = Paragraph(f"📄 {rel_path}", styles['file_heading_style'])
+    heading._source_path = path
+    return [heading, Paragraph(note, styles['info_style'])]
+
+
+def build_story(directory, code_files, fontName, file_indices=None, duplicates=None, start_pages=None):
     """Build story cho PDF"""
     log_info("Bắt đầu build story...")
     start_time = time.time()
     
-    styles = getSampleStyleSheet()
-
-    # Define các styles
-    custom_styles = {
-        'file_heading_style': ParagraphStyle('FileHeading', 
-                                            parent=styles['Heading2'], 
-                                            fontName=fontName, 
-                                            fontSize=14, 
-                                            alignment=TA_LEFT, 
-                                            spaceAfter=8, 
-                                            spaceBefore=12),
-        
-        'code_style': ParagraphStyle('Code', 
-                                   parent=styles['Normal'], 
-                                   fontName=fontName, 
-                                   fontSize=12, 
-                                   alignment=TA_LEFT, 
-                                   spaceAfter=5, 
-                                   spaceBefore=0, 
-                                   leading=13),
-        
-        'info_style': ParagraphStyle('Info', 
-                                   parent=styles['Normal'], 
-                                   fontName=fontName, 
-                                   fontSize=11, 
-                                   alignment=TA_LEFT, 
-                                   spaceAfter=10)
-    }
+    custom_styles = create_styles(fontName)
 
     story = []
     
@@ -424,14 +993,29 @@ def build_story(directory, code_files, fontName, file_indices=None):
     for idx, file_idx in enumerate(files_to_process, 1):
         if file_idx < len(code_files):
             try:
-                elements = build_story_element(
-                    code_files[file_idx], 
-                    directory, 
-                    fontName, 
-                    custom_styles,
-                    file_index=idx,
-                    total_files=total_files
-                )
+                path = code_files[file_idx]
+                if duplicates and path in duplicates:
+                    original = duplicates[path]
+                    elements = build_duplicate_stub(
+                        path,
+                        original,
+                        directory,
+                        custom_styles,
+                        original_page=(start_pages or {}).get(original)
+                    )
+                else:
+                    with memory_stage(os.path.relpath(path, directory), 'file'):
+                        elements = build_story_element(
+                            path, 
+                            directory, 
+                            fontName, 
+                            custom_styles,
+                            file_index=idx,
+                            total_files=total_files
+                        )
+                    check_memory_budget()
+                    # Đánh dấu heading để ghi nhận trang bắt đầu của file
+                    elements[0]._source_path = path
                 story.extend(elements)
                 
                 # Thêm PageBreak nếu không phải file cuối
@@ -441,6 +1025,8 @@ def build_story(directory, code_files, fontName, file_indices=None):
                 # Update progress
                 log_progress(idx, total_files, f"Files processed")
                 
+            except MemoryBudgetExceeded:
+                raise
             except Exception as e:
                 log_error(f"Lỗi xử lý file {code_files[file_idx]}: {e}")
                 log_error(f"Traceback: {traceback.format_exc()}", 1)
@@ -452,7 +1038,7 @@ def build_story(directory, code_files, fontName, file_indices=None):
     return story
 
 
-def count_pages_per_file(directory, code_files, fontName):
+def count_pages_per_file(directory, code_files, fontName, duplicates=None):
     """Đếm số trang cho mỗi file"""
     log_section("PHÂN TÍCH CẤU TRÚC FILE")
     log_info("Đang phân tích số trang cho từng file...")
@@ -467,36 +1053,19 @@ def count_pages_per_file(directory, code_files, fontName):
             log_info(f"[{i}/{total_files}] Analyzing: {rel_path}")
             
             # Tạo story cho file này
-            story = build_story(directory, [path], fontName, file_indices=[0])
+            story = build_story(directory, [path], fontName, file_indices=[0], duplicates=duplicates)
             
             # Đếm số trang
             dummy_buf = BytesIO()
-            dummy_doc = BaseDocTemplate(
-                dummy_buf, 
-                pagesize=A4,
-                leftMargin=15 * mm,
-                rightMargin=15 * mm,
-                topMargin=25 * mm,
-                bottomMargin=25 * mm
-            )
-            
-            frame = Frame(
-                dummy_doc.leftMargin, 
-                dummy_doc.bottomMargin + 20 * mm,
-                dummy_doc.width, 
-                dummy_doc.height - 20 * mm, 
-                id='normal'
-            )
-            
+            dummy_doc = create_doc_template(dummy_buf, 'dummy')
+
             page_count_holder = {'count': 0}
-            
+
             class SingleFilePageCounter(canvas.Canvas):
                 def showPage(self):
                     page_count_holder['count'] += 1
                     super().showPage()
-            
-            dummy_doc.addPageTemplates([PageTemplate(id='dummy', frames=frame)])
-            
+
             dummy_doc.build(story, canvasmaker=SingleFilePageCounter)
             file_pages = page_count_holder['count']
             
@@ -516,6 +1085,8 @@ def count_pages_per_file(directory, code_files, fontName):
             # Update progress
             log_progress(i, total_files, "Files analyzed")
             
+        except MemoryBudgetExceeded:
+            raise
         except Exception as e:
             log_error(f"Lỗi phân tích file {path}: {e}")
             pages_info.append({
@@ -531,6 +1102,16 @@ def count_pages_per_file(directory, code_files, fontName):
     return pages_info
 
 
+def get_section_pages(total_pages, pages_per_section=25):
+    """Tính tập trang đầu/giữa/cuối cần giữ lại, trả về (needed_pages, middle_start)"""
+    first_pages = list(range(1, pages_per_section + 1))
+    middle_start = (total_pages - pages_per_section) // 2 + 1
+    middle_pages = list(range(middle_start, middle_start + pages_per_section))
+    last_pages = list(range(total_pages - pages_per_section + 1, total_pages + 1))
+
+    return set(first_pages + middle_pages + last_pages), middle_start
+
+
 def select_files_for_shortened(pages_info, total_pages, pages_per_section=25):
     """Chọn các file cần thiết để tạo shortened version"""
     log_section("CHỌN FILE CHO SHORTENED VERSION")
@@ -546,12 +1127,7 @@ def select_files_for_shortened(pages_info, total_pages, pages_per_section=25):
         return list(selected_files), None
     
     # Tính các trang cần lấy
-    first_pages = list(range(1, pages_per_section + 1))
-    middle_start = (total_pages - pages_per_section) // 2 + 1
-    middle_pages = list(range(middle_start, middle_start + pages_per_section))
-    last_pages = list(range(total_pages - pages_per_section + 1, total_pages + 1))
-    
-    needed_pages = set(first_pages + middle_pages + last_pages)
+    needed_pages, middle_start = get_section_pages(total_pages, pages_per_section)
     
     log_info(f"Trang cần giữ lại:")
     log_info(f"  • Đầu: 1-{pages_per_section}", 1)
@@ -579,23 +1155,294 @@ def select_files_for_shortened(pages_info, total_pages, pages_per_section=25):
     return sorted(list(selected_files)), page_mapping
 
 
+def read_source_lines(path):
+    """Đọc file, trả về (lines, truncated) với lines đã cắt theo MAX_LINES_PER_FILE"""
+    lines = read_source_text(path)
+
+    truncated = len(lines) > MAX_LINES_PER_FILE
+    if truncated:
+        lines = lines[:MAX_LINES_PER_FILE]
+    return lines, truncated
+
+
+@lru_cache(maxsize=65536)
+def get_word_width(word, fontName, fontSize):
+    """Độ rộng một từ (cache vì code lặp lại rất nhiều từ giống nhau)"""
+    return pdfmetrics.stringWidth(word, fontName, fontSize)
+
+
+def split_long_word(word, first_width, max_width, fontName, fontSize):
+    """
+    Chia một từ dài hơn cả dòng giống splitLongWords của Paragraph:
+    mảnh đầu lấp phần còn trống của dòng hiện tại, các mảnh sau mỗi mảnh một dòng.
+    Trả về độ rộng từng mảnh
+    """
+    pieces = []
+    line_width = word_width = 0
+    limit = first_width
+    for char in word:
+        char_width = get_word_width(char, fontName, fontSize)
+        if line_width + char_width > limit and (word_width or char_width <= max_width):
+            pieces.append(word_width)
+            limit = max_width
+            line_width = word_width = 0
+        word_width += char_width
+        line_width += char_width
+    pieces.append(word_width)
+    return pieces
+
+
+def count_wrapped_lines(text, fontName, fontSize, max_width, space_shrinkage=0):
+    """Ước lượng số dòng hiển thị khi Paragraph tự xuống dòng theo từ"""
+    # Paragraph gộp khoảng trắng liên tiếp và cho phép co khoảng trắng theo space_shrinkage.
+    # Tách từ như Paragraph: không xuống dòng tại khoảng trắng không ngắt (\xa0)
+    words = [word for word in split_paragraph_words(text) if word]
+    widths = [get_word_width(word, fontName, fontSize) for word in words]
+    space_width = get_word_width(' ', fontName, fontSize)
+    shrink = space_shrinkage * space_width
+    if sum(widths) + space_width * (len(words) - 1) <= max_width + shrink * (len(words) - 1):
+        return 1
+
+    count = 1
+    current = None
+    spaces = 0
+    for word, word_width in zip(words, widths):
+        if current is None:
+            new_width, limit = word_width, max_width
+        else:
+            new_width, limit = current + space_width + word_width, max_width + shrink * (spaces + 1)
+
+        if new_width > limit and word_width > max_width:
+            # Từ dài hơn cả dòng: bị cắt thành nhiều mảnh, mảnh cuối mở đầu dòng mới
+            used = 0 if current is None else current + space_width
+            pieces = split_long_word(word, max_width - used, max_width, fontName, fontSize)
+            count += len(pieces) - 1
+            current = pieces[-1]
+            spaces = 0
+        elif current is None:
+            current = word_width
+        elif new_width > limit:
+            count += 1
+            current = word_width
+            spaces = 0
+        else:
+            current = new_width
+            spaces += 1
+    return count
+
+
+def estimate_page_lines(lines, heading_text, truncated, styles):
+    """
+    Mô phỏng cách platypus chia trang cho một file (heading + các batch code).
+    Trả về (page_lines, page_segments), mỗi phần tử ứng với một trang:
+    - page_lines: (dòng đầu, dòng cuối) 1-based của các dòng bắt đầu trên trang, hoặc None
+    - page_segments: list (dòng đầu batch, các lần split trước đó, số dòng hiển thị lấy hoặc None = hết batch)
+      để dựng lại đúng trang bằng Paragraph.split
+    """
+    code_style = styles['code_style']
+    heading_style = styles['file_heading_style']
+    info_style = styles['info_style']
+    width, height = get_frame_content_size()
+    leading = code_style.leading
+
+    page_lines = [None]
+    page_segments = [[]]
+    last_marked = 0
+
+    # Heading luôn ở đầu frame (sau PageBreak) nên không có spaceBefore
+    y = height
+    y -= count_wrapped_lines(heading_text, heading_style.fontName, heading_style.fontSize, width,
+                             heading_style.spaceShrinkage) * heading_style.leading
+    y -= heading_style.spaceAfter
+    if truncated:
+        note = f"⚠️ File bị cắt ngắn, chỉ hiển thị {MAX_LINES_PER_FILE} dòng đầu"
+        y -= count_wrapped_lines(note, info_style.fontName, info_style.fontSize, width,
+                                 info_style.spaceShrinkage) * info_style.leading
+        y -= info_style.spaceAfter
+
+    for start in range(0, len(lines), CODE_BATCH_SIZE):
+        # Mỗi phần tử là số dòng nguồn của một dòng hiển thị
+        rows = []
+        for idx, line in enumerate(lines[start:start + CODE_BATCH_SIZE], start=start + 1):
+            wrapped = count_wrapped_lines(format_code_line(line, idx), code_style.fontName,
+                                          code_style.fontSize, width, code_style.spaceShrinkage)
+            rows.extend([idx] * wrapped)
+
+        # Số dòng hiển thị của từng lần batch bị split qua trang
+        splits = []
+        while rows:
+            if len(rows) * leading <= y:
+                placed, rows = rows, []
+                take = None
+            else:
+                fit = int(y // leading)
+                # Paragraph không để lại 1 dòng mồ côi cuối trang
+                if fit < 2:
+                    page_lines.append(None)
+                    page_segments.append([])
+                    y = height
+                    continue
+                placed, rows = rows[:fit], rows[fit:]
+                take = fit
+                # Tách đúng ranh giới dòng nguồn thì phần sau bắt đầu bằng một dòng trống (<br/>)
+                if rows[0] != placed[-1]:
+                    rows.insert(0, 0)
+
+            page_segments[-1].append((start + 1, tuple(splits), take))
+            if take:
+                splits.append(take)
+
+            for line_no in placed:
+                if line_no > last_marked:
+                    current = page_lines[-1]
+                    page_lines[-1] = (current[0] if current else line_no, line_no)
+                    last_marked = line_no
+
+            if rows:
+                page_lines.append(None)
+                page_segments.append([])
+                y = height
+            else:
+                y -= len(placed) * leading + code_style.spaceAfter
+
+    return page_lines, page_segments
+
+
+def estimate_layout(directory, code_files, fontName, duplicates=None):
+    """Ước lượng số trang và khoảng dòng trên mỗi trang cho từng file, không build PDF"""
+    log_info("Đang ước lượng bố cục trang từ số dòng...")
+    start_time = time.time()
+
+    styles = create_styles(fontName)
+    pages_info = []
+    current_page = 1
+
+    for i, path in enumerate(code_files):
+        rel_path = os.path.relpath(path, directory)
+        duplicate_of = (duplicates or {}).get(path)
+        if duplicate_of:
+            # File trùng chỉ chiếm một trang tham chiếu
+            page_lines, page_segments, truncated = [None], [[]], False
+        else:
+            try:
+                lines, truncated = read_source_lines(path)
+            except Exception as e:
+                log_error(f"Không thể đọc file {rel_path}: {e}", 1)
+                lines, truncated = [], False
+
+            page_lines, page_segments = estimate_page_lines(lines, f"📄 {rel_path}", truncated, styles)
+        file_pages = len(page_lines)
+
+        pages_info.append({
+            'file_index': i,
+            'file_path': path,
+            'start_page': current_page,
+            'end_page': current_page + file_pages - 1,
+            'page_count': file_pages,
+            'page_lines': page_lines,
+            'page_segments': page_segments,
+            'truncated': truncated,
+            'duplicate_of': duplicate_of
+        })
+        current_page += file_pages
+
+    log_success(f"Ước lượng xong: ~{current_page - 1} trang ({time.time() - start_time:.2f}s)")
+    return pages_info
+
+
+def select_page_slices(pages_info, needed_pages):
+    """Chọn các lát (file, trang gốc, các đoạn batch) nằm trong các trang cần giữ"""
+    slices = []
+    for info in pages_info:
+        for offset, segments in enumerate(info['page_segments']):
+            original_page = info['start_page'] + offset
+            if original_page in needed_pages:
+                slices.append({
+                    'file_index': info['file_index'],
+                    'original_page': original_page,
+                    'segments': segments,
+                    'with_heading': offset == 0,
+                    'truncated': info['truncated'],
+                    'duplicate_of': info['duplicate_of']
+                })
+    return slices
+
+
+def build_slice_story(directory, code_files, fontName, slices, start_pages=None):
+    """Build story chỉ gồm các khoảng dòng đã chọn, mỗi lát đúng một trang"""
+    log_info(f"Bắt đầu build story cho {len(slices)} trang...")
+    start_time = time.time()
+
+    styles = create_styles(fontName)
+    code_style = styles['code_style']
+    leading = code_style.leading
+    width, _ = get_frame_content_size()
+    story = []
+    cached_index = None
+    lines = []
+
+    for n, item in enumerate(slices, 1):
+        path = code_files[item['file_index']]
+        if item['file_index'] != cached_index and not item['duplicate_of']:
+            try:
+                lines, _ = read_source_lines(path)
+            except Exception as e:
+                log_error(f"Không thể đọc file {path}: {e}", 1)
+                lines = []
+            cached_index = item['file_index']
+
+        content = []
+        if item['duplicate_of']:
+            content = build_duplicate_stub(path, item['duplicate_of'], directory, styles,
+                                           original_page=(start_pages or {}).get(item['duplicate_of']))
+        elif item['with_heading']:
+            rel_path = os.path.relpath(path, directory)
+            content.append(Paragraph(f"📄 {rel_path}", styles['file_heading_style']))
+            if item['truncated']:
+                content.append(Paragraph(f"⚠️ File bị cắt ngắn, chỉ hiển thị {MAX_LINES_PER_FILE} dòng đầu",
+                                         styles['info_style']))
+
+        for batch_first, splits, take in item['segments']:
+            start = batch_first - 1
+            paragraph = Paragraph(format_code_batch(lines[start:start + CODE_BATCH_SIZE], batch_first), code_style)
+            # Lặp lại đúng chuỗi split của bản Full để trang bắt đầu/kết thúc ở cùng dòng hiển thị
+            for fit in splits:
+                paragraph = paragraph.split(width, (fit + 0.5) * leading)[1]
+            if take:
+                paragraph = paragraph.split(width, (take + 0.5) * leading)[0]
+            content.append(paragraph)
+
+        content = content or [Spacer(1, 1)]
+        # Đánh dấu file của trang để đo bộ nhớ khi build theo từng file
+        content[0]._source_path = path
+        story.extend(content)
+        if n < len(slices):
+            story.append(PageBreak())
+
+    log_success(f"Hoàn thành build story ({time.time() - start_time:.2f}s)")
+    return story
+
+
 def create_pdf_document(output_path, directory, code_files, is_shortened=False, 
-                       file_indices=None, page_mapping=None, total_pages_original=None):
+                       file_indices=None, page_mapping=None, total_pages_original=None,
+                       duplicates=None):
     """Tạo PDF document"""
     version_name = "SHORTENED" if is_shortened else "FULL"
     log_section(f"TẠO {version_name} PDF")
     
     fontName = register_fonts()
     
-    def create_story():
-        return build_story(directory, code_files, fontName, file_indices)
+    def create_story(start_pages=None):
+        return build_story(directory, code_files, fontName, file_indices,
+                           duplicates=duplicates, start_pages=start_pages)
     
     # Lần 1: Đếm số trang
     log_info("Bước 1: Tính toán số trang...")
     start_time = time.time()
     
     log_info("  Đang tạo story cho việc đếm trang...")
-    story_for_counting = create_story()
+    with memory_stage(f"{version_name}: story đếm trang"):
+        story_for_counting = create_story()
     log_info(f"  Story đã tạo với {len(story_for_counting)} elements")
     
     total_pages_holder = {}
@@ -609,6 +1456,7 @@ def create_pdf_document(output_path, directory, code_files, is_shortened=False,
             self._page_count += 1
             if self._page_count % 100 == 0:
                 log_info(f"    Đang đếm: {self._page_count} trang...")
+            check_memory_budget()
             super().showPage()
         
         def save(self):
@@ -617,28 +1465,22 @@ def create_pdf_document(output_path, directory, code_files, is_shortened=False,
 
     try:
         dummy_buf = BytesIO()
-        dummy_doc = BaseDocTemplate(
-            dummy_buf, 
-            pagesize=A4,
-            leftMargin=15 * mm,
-            rightMargin=15 * mm,
-            topMargin=25 * mm,
-            bottomMargin=25 * mm
-        )
-        
-        frame = Frame(
-            dummy_doc.leftMargin, 
-            dummy_doc.bottomMargin + 20 * mm,
-            dummy_doc.width, 
-            dummy_doc.height - 20 * mm, 
-            id='normal'
-        )
-        
-        dummy_doc.addPageTemplates([PageTemplate(id='dummy', frames=frame)])
-        
+        dummy_doc = create_doc_template(dummy_buf, 'dummy')
+
+        # Ghi nhận trang bắt đầu của từng file (dùng cho trang tham chiếu của file trùng)
+        start_pages = {}
+
+        def record_start_page(flowable):
+            path = getattr(flowable, '_source_path', None)
+            if path is not None and path not in start_pages:
+                start_pages[path] = dummy_doc.page
+
+        dummy_doc.afterFlowable = record_start_page
+
         log_info("  Bắt đầu build dummy document để đếm trang...")
         build_start = time.time()
-        dummy_doc.build(story_for_counting, canvasmaker=PageCounterCanvas)
+        with memory_stage(f"{version_name}: build đếm trang"), memory_build_stages(dummy_doc, directory, story_for_counting):
+            dummy_doc.build(story_for_counting, canvasmaker=PageCounterCanvas)
         log_info(f"  Build dummy document xong ({time.time() - build_start:.2f}s)")
         
         if not is_shortened:
@@ -662,6 +1504,8 @@ def create_pdf_document(output_path, directory, code_files, is_shortened=False,
                 log_info("Đã hủy tạo PDF")
                 return None
         
+    except MemoryBudgetExceeded:
+        raise
     except Exception as e:
         log_error(f"Lỗi khi đếm số trang: {e}")
         log_error(f"Traceback: {traceback.format_exc()}")
@@ -673,39 +1517,25 @@ def create_pdf_document(output_path, directory, code_files, is_shortened=False,
     
     try:
         log_info("  Đang tạo lại story cho render cuối cùng...")
-        story_for_final = create_story()
+        if is_shortened and page_mapping:
+            start_pages = {path: page_mapping.get(page, page) for path, page in start_pages.items()}
+        with memory_stage(f"{version_name}: story render"):
+            story_for_final = create_story(start_pages)
         log_info(f"  Story final có {len(story_for_final)} elements")
         
-        final_doc = BaseDocTemplate(
-            output_path,
-            pagesize=A4,
-            leftMargin=15 * mm,
-            rightMargin=15 * mm,
-            topMargin=25 * mm,
-            bottomMargin=25 * mm
-        )
-
-        frame_final = Frame(
-            final_doc.leftMargin, 
-            final_doc.bottomMargin + 20 * mm,
-            final_doc.width, 
-            final_doc.height - 20 * mm, 
-            id='normal'
-        )
-
         def on_page(canvas_obj, doc_obj):
             current = canvas_obj.getPageNumber()
             if current % 100 == 0:
                 log_info(f"    Đang render: trang {current}/{total_pages}...")
+            check_memory_budget()
             draw_footer(canvas_obj, doc_obj, page_mapping, total_pages, fontName, is_shortened)
 
-        final_doc.addPageTemplates([
-            PageTemplate(id='real', frames=frame_final, onPage=on_page)
-        ])
-        
+        final_doc = create_doc_template(output_path, 'real', on_page)
+
         log_info("  Bắt đầu build PDF final...")
         build_start = time.time()
-        final_doc.build(story_for_final)
+        with memory_stage(f"{version_name}: build render"), memory_build_stages(final_doc, directory, story_for_final):
+            final_doc.build(story_for_final)
         log_info(f"  Build PDF final xong ({time.time() - build_start:.2f}s)")
         
         elapsed = time.time() - start_time
@@ -715,35 +1545,1083 @@ def create_pdf_document(output_path, directory, code_files, is_shortened=False,
         log_info(f"File size: {file_size:.2f} MB")
         log_info(f"Output: {output_path}")
         
+    except MemoryBudgetExceeded:
+        raise
     except Exception as e:
         log_error(f"Lỗi khi render PDF: {e}")
         log_error(f"Traceback: {traceback.format_exc()}")
         raise
     
+    if duplicates and not is_shortened:
+        page_counts = get_page_counts(start_pages, total_pages)
+        report_duplicates(directory, duplicates, page_counts, elapsed / max(total_pages, 1))
+    
     return total_pages
 
 
-def main():
-    log_section("SOURCE CODE TO PDF CONVERTER")
-    log_info(f"Start time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    
-    # Kiểm tra thư viện
-    try:
-        from reportlab.lib.pagesizes import A4
-        log_success("Thư viện reportlab đã sẵn sàng")
+def get_page_counts(start_pages, total_pages):
+    """Tính số trang của từng file từ trang bắt đầu"""
+    ordered = sorted(start_pages.items(), key=lambda item: item[1])
+    page_counts = {}
+    for i, (path, start) in enumerate(ordered):
+        end = ordered[i + 1][1] - 1 if i + 1 < len(ordered) else total_pages
+        page_counts[path] = end - start + 1
+    return page_counts
+
+
+def get_fragment_key(rel_path, content_hash, fontName, original_page=None):
+    """Khóa nội dung của một fragment: đổi file, cấu hình hay trang tham chiếu thì khóa đổi"""
+    digest = hashlib.blake2b(digest_size=16)
+    parts = [
+        CHECKPOINT_VERSION, rel_path, content_hash, fontName, original_page,
+        MAX_LINES_PER_FILE, CODE_BATCH_SIZE, PAGE_MARGIN_X, PAGE_MARGIN_Y, FOOTER_HEIGHT
+    ]
+    digest.update(json.dumps(parts, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_checkpoint_manifest(work_dir):
+    """Đọc manifest checkpoint: {fragment key: số trang}"""
+    manifest_path = os.path.join(work_dir, 'manifest.json')
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == CHECKPOINT_VERSION:
+            return manifest
+        log_warning("Manifest checkpoint khác phiên bản → bỏ qua", 1)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log_warning(f"Không đọc được manifest checkpoint: {e}", 1)
+    return {'version': CHECKPOINT_VERSION, 'fragments': {}}
+
+
+def save_checkpoint_manifest(work_dir, manifest):
+    """Ghi manifest checkpoint (ghi file tạm rồi đổi tên để không bị hỏng khi dừng giữa chừng)"""
+    manifest_path = os.path.join(work_dir, 'manifest.json')
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def stamp_footers(pages, page_numbers, total_pages, fontName):
+    """Vẽ footer "x/total" lên các trang PDF bằng overlay (page_numbers: số trang hiển thị tương ứng)"""
+    from pypdf import PdfReader
+
+    # Dùng page_mapping của draw_footer để overlay thứ i mang số trang thật
+    page_mapping = {i: number for i, number in enumerate(page_numbers, 1)}
+
+    overlay_buf = BytesIO()
+    overlay = canvas.Canvas(overlay_buf, pagesize=A4)
+    for _ in pages:
+        draw_footer(overlay, None, page_mapping, total_pages, fontName, is_shortened=True)
+        overlay.showPage()
+    overlay.save()
+
+    overlay_reader = PdfReader(BytesIO(overlay_buf.getvalue()))
+    for page, overlay_page in zip(pages, overlay_reader.pages):
+        page.merge_page(overlay_page)
+        # merge_page ghi content stream ở dạng không nén, nén lại để file không phình to
+        page.compress_content_streams()
+
+
+def render_shard_fragment(fragment_path, directory, shard_files, fontName, duplicates, start_pages, first_page):
+    """
+    Render một shard (nhiều file liên tiếp) thành một PDF chưa có footer, trả về số trang từng file.
+    Cả shard dùng chung một bản font nhúng thay vì mỗi file một bản
+    """
+    start_pages = dict(start_pages)
+    # File trùng có bản gốc nằm cùng shard chỉ biết trang tham chiếu sau lần render đầu
+    passes = 2 if any(duplicates.get(path) in shard_files for path in shard_files) else 1
+    tmp_path = fragment_path + '.tmp'
+
+    for _ in range(passes):
+        story = build_story(directory, shard_files, fontName, duplicates=duplicates, start_pages=start_pages)
+        doc = create_doc_template(tmp_path, 'fragment')
+        file_starts = {}
+
+        def record_start(flowable):
+            path = getattr(flowable, '_source_path', None)
+            if path and path not in file_starts:
+                file_starts[path] = doc.page
+
+        doc.afterFlowable = record_start
+        with memory_build_stages(doc, directory, story):
+            doc.build(story)
+        start_pages.update({path: first_page + page - 1 for path, page in file_starts.items()})
+
+    os.replace(tmp_path, fragment_path)
+
+    # File lỗi bị build_story bỏ qua thì không có trang nào
+    page_counts = []
+    for i, path in enumerate(shard_files):
+        if path not in file_starts:
+            page_counts.append(0)
+            continue
+        next_start = next((file_starts[p] for p in shard_files[i + 1:] if p in file_starts), doc.page + 1)
+        page_counts.append(next_start - file_starts[path])
+    return page_counts
+
+
+def get_content_hash(path, hash_cache=None):
+    """Hash nội dung file, dùng lại hash cũ nếu mtime/size không đổi"""
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if hash_cache is not None:
+        cached = hash_cache.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    content_hash = hash_file(path)
+    if hash_cache is not None:
+        hash_cache[path] = (signature, content_hash)
+    return content_hash
+
+
+def split_shards(directory, code_files):
+    """
+    Chia file thành các shard liên tiếp để render chung. Ranh giới shard dựa trên hash đường dẫn
+    nên sửa/thêm/xóa một file chỉ làm đổi shard chứa nó
+    """
+    shards = []
+    current = []
+    for path in code_files:
+        current.append(path)
+        rel_path = os.path.relpath(path, directory)
+        marker = int(hashlib.blake2b(rel_path.encode('utf-8'), digest_size=4).hexdigest(), 16)
+        if marker % CHECKPOINT_SHARD_FILES == 0 or len(current) >= 2 * CHECKPOINT_SHARD_FILES:
+            shards.append(current)
+            current = []
+    if current:
+        shards.append(current)
+    return shards
+
+
+def render_fragments(directory, code_files, duplicates, work_dir, manifest, fontName, hash_cache=None):
+    """
+    Render các shard thành fragment trong work_dir, bỏ qua fragment còn hợp lệ.
+    Trả về (pages_info, thống kê); mỗi file trỏ tới fragment của shard và vị trí trang trong đó
+    """
+    fragments = manifest['fragments']
+    pages_info = []
+    start_pages = {}
+    current_page = 1
+    stats = {'reused': 0, 'rendered_files': 0, 'rendered_pages': 0}
+    shards = split_shards(directory, code_files)
+    file_index = 0
+
+    for shard_number, shard_files in enumerate(shards, 1):
+        hashes = {}
+        for path in shard_files:
+            try:
+                hashes[path] = get_content_hash(path, hash_cache)
+            except OSError as e:
+                log_error(f"Không thể đọc file {os.path.relpath(path, directory)}: {e}", 1)
+                hashes[path] = None
+
+        # Khóa shard: khóa từng file + trang bắt đầu shard nếu có file trùng tham chiếu trong shard
+        parts = []
+        local_reference = False
+        for path in shard_files:
+            original = duplicates.get(path)
+            if original in shard_files:
+                reference = os.path.relpath(original, directory)
+                local_reference = True
+            else:
+                reference = start_pages.get(original) if original else None
+            parts.append(get_fragment_key(os.path.relpath(path, directory), hashes[path], fontName, reference))
+        if local_reference:
+            parts.append(current_page)
+        shard_key = hashlib.blake2b(json.dumps(parts).encode('utf-8'), digest_size=16).hexdigest()
+        fragment_path = os.path.join(work_dir, f"{shard_key}.pdf")
+
+        if shard_key in fragments and os.path.exists(fragment_path):
+            page_counts = fragments[shard_key]
+            stats['reused'] += len(shard_files)
+        else:
+            log_info(f"[{shard_number}/{len(shards)}] Rendering shard: {len(shard_files)} files "
+                     f"({os.path.relpath(shard_files[0], directory)} ...)")
+            page_counts = render_shard_fragment(fragment_path, directory, shard_files, fontName, duplicates,
+                                                start_pages, current_page)
+            fragments[shard_key] = page_counts
+            stats['rendered_files'] += len(shard_files)
+            stats['rendered_pages'] += sum(page_counts)
+            save_checkpoint_manifest(work_dir, manifest)
+
+        offset = 0
+        for path, page_count in zip(shard_files, page_counts):
+            start_pages[path] = current_page
+            original = duplicates.get(path)
+            # Khóa file gồm trang tham chiếu thật để watch mode biết khi nào trang cũ không còn đúng
+            key = get_fragment_key(os.path.relpath(path, directory), hashes[path], fontName,
+                                   start_pages.get(original) if original else None)
+            pages_info.append({
+                'file_index': file_index,
+                'file_path': path,
+                'start_page': current_page,
+                'end_page': current_page + page_count - 1,
+                'page_count': page_count,
+                'key': key,
+                'fragment': fragment_path,
+                'fragment_offset': offset
+            })
+            file_index += 1
+            offset += page_count
+            current_page += page_count
+
+    return pages_info, stats
+
+
+def assemble_fragments(output_path, pages_info, total_pages, fontName, previous=None):
+    """
+    Ghép fragment thành PDF cuối và vẽ footer liên tục.
+    previous = {'output_path', 'total_pages', 'files': {path: info}} của lần ghép trước:
+    file không đổi nội dung, trang bắt đầu và tổng số trang thì lấy lại trang đã có footer.
+    Trả về số trang phải vẽ lại footer
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    previous_reader = None
+    if previous and previous['total_pages'] == total_pages and os.path.exists(previous['output_path']):
+        previous_reader = PdfReader(previous['output_path'])
+
+    writer = PdfWriter()
+    new_pages = []
+    page_numbers = []
+    # Một reader cho mỗi fragment để các trang cùng shard dùng chung object font khi ghi
+    readers = {}
+    for info in pages_info:
+        old = previous['files'].get(info['file_path']) if previous_reader else None
+        if old and old['key'] == info['key'] and old['start_page'] == info['start_page']:
+            for page_index in range(old['start_page'] - 1, old['end_page']):
+                writer.add_page(previous_reader.pages[page_index])
+        else:
+            if info['fragment'] not in readers:
+                readers[info['fragment']] = PdfReader(info['fragment'])
+            fragment_pages = readers[info['fragment']].pages
+            first = info['fragment_offset']
+            new_pages.extend(writer.add_page(fragment_pages[index])
+                             for index in range(first, first + info['page_count']))
+            page_numbers.extend(range(info['start_page'], info['end_page'] + 1))
+
+    # Vẽ footer một lần cho tất cả trang mới để font của overlay chỉ nhúng một lần
+    if new_pages:
+        stamp_footers(new_pages, page_numbers, total_pages, fontName)
+
+    tmp_output = output_path + '.tmp'
+    with open(tmp_output, 'wb') as f:
+        writer.write(f)
+    os.replace(tmp_output, output_path)
+    return len(new_pages)
+
+
+def cleanup_fragments(work_dir, manifest, pages_info):
+    """Xóa các fragment không còn được dùng"""
+    used = {os.path.basename(info['fragment']) for info in pages_info}
+    for name in os.listdir(work_dir):
+        if name.endswith('.pdf') and name not in used:
+            os.remove(os.path.join(work_dir, name))
+            manifest['fragments'].pop(name[:-4], None)
+    save_checkpoint_manifest(work_dir, manifest)
+
+
+def create_pdf_resumable(output_path, directory, code_files, duplicates=None):
+    """
+    Tạo FULL PDF theo từng file với checkpoint trong thư mục làm việc.
+    Chạy lại với cùng input sẽ dùng lại các fragment đã render xong.
+    Trả về (total_pages, pages_info)
+    """
+    log_section("TẠO FULL PDF (CÓ CHECKPOINT)")
+
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        log_error("Chưa cài đặt pypdf (cần cho chế độ checkpoint)!")
+        log_info("Vui lòng cài đặt: pip install pypdf")
+        return None, None
+
+    fontName = register_fonts()
+    duplicates = duplicates or {}
+
+    work_dir = os.path.join(directory, CHECKPOINT_DIR_NAME)
+    os.makedirs(work_dir, exist_ok=True)
+    manifest = load_checkpoint_manifest(work_dir)
+    log_info(f"Thư mục checkpoint: {work_dir}")
+
+    # Bước 1: Render theo shard (bỏ qua fragment còn hợp lệ)
+    log_info("Bước 1: Render theo shard...")
+    start_time = time.time()
+    with memory_stage("FULL: render fragment"):
+        pages_info, stats = render_fragments(directory, code_files, duplicates, work_dir, manifest, fontName)
+
+    total_pages = pages_info[-1]['end_page'] if pages_info else 0
+    render_elapsed = time.time() - start_time
+    log_success(f"Hoàn thành render fragment ({render_elapsed:.2f}s)")
+    log_info(f"Dùng lại {stats['reused']}/{len(code_files)} file từ checkpoint", 1)
+
+    # Bước 2: Ghép fragment và đóng dấu footer liên tục
+    log_info("Bước 2: Ghép PDF và vẽ footer...")
+    start_time = time.time()
+
+    with memory_stage("FULL: ghép fragment"):
+        assemble_fragments(output_path, pages_info, total_pages, fontName)
+    cleanup_fragments(work_dir, manifest, pages_info)
+
+    file_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
+    log_success(f"Hoàn thành ghép PDF ({time.time() - start_time:.2f}s)")
+    log_info(f"Tổng số trang: {total_pages}")
+    log_info(f"File size: {file_size:.2f} MB")
+    log_info(f"Output: {output_path}")
+
+    if duplicates:
+        page_counts = {info['file_path']: info['page_count'] for info in pages_info}
+        report_duplicates(directory, duplicates, page_counts, render_elapsed / max(stats['rendered_pages'], 1))
+
+    return total_pages, pages_info
+
+
+def take_file_snapshot(code_files):
+    """Snapshot (mtime, size) của danh sách file, bỏ qua file đã bị xóa"""
+    snapshot = {}
+    for path in code_files:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def watch_and_rebuild(output_path, directory, code_files, duplicates=None, interval=WATCH_INTERVAL):
+    """Theo dõi các file đã quét, khi có thay đổi chỉ render lại shard chứa file đổi và ghép lại PDF"""
+    total_pages, pages_info = create_pdf_resumable(output_path, directory, code_files, duplicates)
+    if total_pages is None:
+        return
+
+    fontName = register_fonts()
+    work_dir = os.path.join(directory, CHECKPOINT_DIR_NAME)
+    manifest = load_checkpoint_manifest(work_dir)
+    hash_cache = {}
+    snapshot = take_file_snapshot(code_files)
+
+    log_section("WATCH MODE")
+    log_info(f"Đang theo dõi {len(snapshot)} files (kiểm tra mỗi {interval}s) - Ctrl+C để dừng")
+
+    try:
+        while True:
+            time.sleep(interval)
+            new_snapshot = take_file_snapshot(code_files)
+            if new_snapshot == snapshot:
+                continue
+
+            changed = [p for p in new_snapshot if snapshot.get(p) != new_snapshot[p]]
+            removed = [p for p in snapshot if p not in new_snapshot]
+            for path in changed:
+                log_info(f"✎ Thay đổi: {os.path.relpath(path, directory)}", 1)
+            for path in removed:
+                log_warning(f"✗ Đã xóa: {os.path.relpath(path, directory)}", 1)
+
+            start_time = time.time()
+            snapshot = new_snapshot
+            code_files = [p for p in code_files if p in snapshot]
+            previous = {
+                'output_path': output_path,
+                'total_pages': total_pages,
+                'files': {info['file_path']: info for info in pages_info}
+            }
+
+            duplicates = find_duplicate_files(code_files)
+            pages_info, stats = render_fragments(directory, code_files, duplicates, work_dir, manifest,
+                                                 fontName, hash_cache)
+            total_pages = pages_info[-1]['end_page'] if pages_info else 0
+            stamped_pages = assemble_fragments(output_path, pages_info, total_pages, fontName, previous)
+            cleanup_fragments(work_dir, manifest, pages_info)
+
+            log_success(f"Đã cập nhật PDF ({time.time() - start_time:.2f}s): "
+                        f"render lại {stats['rendered_files']} files, vẽ lại footer {stamped_pages} trang, "
+                        f"tổng {total_pages} trang")
+
+    except KeyboardInterrupt:
+        log_info("Đã dừng watch mode")
+
+    return total_pages
+
+
+def get_footer_overhead(fontName, total_pages):
+    """Dung lượng overlay footer (chủ yếu là font nhúng) cộng thêm vào mỗi volume"""
+    overlay_buf = BytesIO()
+    overlay = canvas.Canvas(overlay_buf, pagesize=A4)
+    draw_footer(overlay, None, {1: total_pages}, total_pages, fontName, is_shortened=True)
+    overlay.showPage()
+    overlay.save()
+    return len(overlay_buf.getvalue())
+
+
+def parse_volume_limit(limit):
+    """Đọc giới hạn volume dạng '500' (trang) hoặc '50MB', trả về (max_pages, max_bytes). Sai định dạng → ValueError"""
+    limit = limit.strip().upper()
+    if limit.endswith('MB'):
+        max_pages, max_bytes = None, float(limit[:-2]) * 1024 * 1024
+    else:
+        max_pages, max_bytes = int(limit), None
+
+    value = max_pages if max_pages is not None else max_bytes
+    if not 0 < value < float('inf'):
+        raise ValueError(f"Giới hạn volume phải là số dương: {limit}")
+    return max_pages, max_bytes
+
+
+def get_fragment_costs(pages_info):
+    """
+    Tách dung lượng mỗi fragment khi ghi bằng pypdf thành phần cố định (font nhúng, resource dùng chung)
+    và phần của từng trang. Volume chỉ lấy một trang của shard vẫn phải mang cả phần cố định.
+    Trả về {fragment: (fixed_bytes, [bytes/trang])}
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    def get_written_size(pages):
+        # Ghi các trang đã bỏ content stream: chỉ còn font, resource và object trang
+        writer = PdfWriter()
+        for page in pages:
+            del writer.add_page(page)['/Contents']
+        buf = BytesIO()
+        writer.write(buf)
+        return len(buf.getvalue())
+
+    costs = {}
+    for info in pages_info:
+        fragment = info['fragment']
+        if fragment in costs:
+            continue
+
+        pages = PdfReader(fragment).pages
+        fixed_bytes = get_written_size(pages[:1])
+        page_object_bytes = (get_written_size(pages) - fixed_bytes) / max(len(pages) - 1, 1)
+        page_bytes = []
+        for page in pages:
+            # Content stream được nén lại (FlateDecode) khi vẽ footer
+            contents = page.get_contents()
+            page_bytes.append(page_object_bytes + (len(zlib.compress(contents.get_data())) if contents else 0))
+        costs[fragment] = (fixed_bytes, page_bytes)
+    return costs
+
+
+def split_volumes(pages_info, max_pages=None, max_bytes=None, overhead_bytes=0, fragment_costs=None):
+    """
+    Chia danh sách file thành các volume tại ranh giới file theo giới hạn trang/bytes.
+    Kích thước ước lượng = overhead_bytes + content stream các trang + phần cố định của mỗi shard mà volume dùng tới.
+    File vượt giới hạn được đặt riêng một volume
+    """
+    if max_bytes and fragment_costs is None:
+        fragment_costs = get_fragment_costs(pages_info)
+
+    volumes = []
+    current = []
+    current_pages = 0
+    current_bytes = overhead_bytes
+    current_fragments = set()
+
+    for info in pages_info:
+        page_bytes = fixed_bytes = 0
+        if max_bytes:
+            fixed_bytes, fragment_page_bytes = fragment_costs[info['fragment']]
+            first = info['fragment_offset']
+            page_bytes = sum(fragment_page_bytes[first:first + info['page_count']])
+        file_bytes = page_bytes + (0 if info['fragment'] in current_fragments else fixed_bytes)
+
+        over_pages = max_pages and current_pages + info['page_count'] > max_pages
+        over_bytes = max_bytes and current_bytes + file_bytes > max_bytes
+        if current and (over_pages or over_bytes):
+            volumes.append(current)
+            current, current_pages, current_bytes = [], 0, overhead_bytes
+            current_fragments = set()
+            # Volume mới phải mang lại phần cố định của shard
+            file_bytes = page_bytes + fixed_bytes
+
+        current.append(info)
+        current_pages += info['page_count']
+        current_bytes += file_bytes
+        current_fragments.add(info['fragment'])
+
+        if (max_pages and info['page_count'] > max_pages) or (max_bytes and current_bytes > max_bytes):
+            log_warning(f"File vượt giới hạn volume: {info['file_path']} "
+                        f"({info['page_count']} trang, {file_bytes / (1024 * 1024):.1f} MB)", 1)
+
+    if current:
+        volumes.append(current)
+    return volumes
+
+
+def enforce_volume_bytes(output_dir, volumes, total_pages, fontName, max_bytes):
+    """
+    Kiểm tra dung lượng thật của các volume đã ghi: volume nhiều file vượt max_bytes được chia đôi
+    tại ranh giới file và ghi lại cho tới khi không còn volume vượt. Trả về danh sách volume cuối cùng
+    """
+    while True:
+        oversized = {index for index, infos in enumerate(volumes)
+                     if len(infos) > 1 and os.path.getsize(
+                         os.path.join(output_dir, VOLUME_FILE_PATTERN.format(index + 1))) > max_bytes}
+        if not oversized:
+            return volumes
+        log_warning(f"{len(oversized)} volume vượt {max_bytes / (1024 * 1024):.2f} MB sau khi ghi, chia lại...", 1)
+
+        resplit = []
+        renames = []
+        for index, infos in enumerate(volumes):
+            if index not in oversized:
+                renames.append((index + 1, len(resplit) + 1))
+                resplit.append(infos)
+                continue
+            # Cắt tại file gần nửa số trang nhất, mỗi nửa có ít nhất một file
+            half = sum(info['page_count'] for info in infos) / 2
+            cut = 1
+            pages = infos[0]['page_count']
+            while cut < len(infos) - 1 and pages + infos[cut]['page_count'] <= half:
+                pages += infos[cut]['page_count']
+                cut += 1
+            resplit.extend([infos[:cut], infos[cut:]])
+
+        # Footer đánh số theo toàn bộ tài liệu nên volume không đổi chỉ cần đổi tên theo số thứ tự mới
+        for old_number, new_number in reversed(renames):
+            if old_number != new_number:
+                os.replace(os.path.join(output_dir, VOLUME_FILE_PATTERN.format(old_number)),
+                           os.path.join(output_dir, VOLUME_FILE_PATTERN.format(new_number)))
+        kept = {new_number for _, new_number in renames}
+        numbers = [number for number in range(1, len(resplit) + 1) if number not in kept]
+        write_volumes(output_dir, [resplit[number - 1] for number in numbers], total_pages, fontName, numbers)
+        volumes = resplit
+
+
+def save_volume_manifest(manifest_path, directory, fontName, total_pages, volumes, duplicates):
+    """Ghi manifest: volume nào chứa file nào, trang bao nhiêu (để tạo lại từng volume)"""
+    manifest = {
+        'version': CHECKPOINT_VERSION,
+        'directory': directory,
+        'font': fontName,
+        'total_pages': total_pages,
+        'volumes': [],
+        'files': []
+    }
+    for number, infos in enumerate(volumes, 1):
+        manifest['volumes'].append({
+            'volume': number,
+            'output': VOLUME_FILE_PATTERN.format(number),
+            'start_page': infos[0]['start_page'],
+            'end_page': infos[-1]['end_page'],
+            'file_count': len(infos)
+        })
+        for info in infos:
+            duplicate_of = duplicates.get(info['file_path'])
+            manifest['files'].append({
+                'path': os.path.relpath(info['file_path'], directory),
+                'volume': number,
+                'start_page': info['start_page'],
+                'end_page': info['end_page'],
+                'key': info['key'],
+                'duplicate_of': os.path.relpath(duplicate_of, directory) if duplicate_of else None
+            })
+
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def write_volumes(output_dir, volumes, total_pages, fontName, volume_numbers=None):
+    """Ghi song song các volume, footer đánh số liên tục trên toàn bộ bộ tài liệu"""
+    volume_numbers = volume_numbers or range(1, len(volumes) + 1)
+
+    def write_volume(number, infos):
+        start_time = time.time()
+        output_path = os.path.join(output_dir, VOLUME_FILE_PATTERN.format(number))
+        assemble_fragments(output_path, infos, total_pages, fontName)
+        return number, output_path, time.time() - start_time
+
+    with ThreadPoolExecutor(max_workers=MAX_VOLUME_WORKERS) as executor:
+        futures = [executor.submit(write_volume, number, infos)
+                   for number, infos in zip(volume_numbers, volumes)]
+        for future in as_completed(futures):
+            number, output_path, elapsed = future.result()
+            file_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
+            log_success(f"Volume {number}: {os.path.basename(output_path)} "
+                        f"({file_size:.2f} MB, {elapsed:.2f}s)", 1)
+
+
+def create_pdf_volumes(output_dir, directory, code_files, duplicates=None, max_pages=None, max_bytes=None):
+    """
+    Tạo FULL PDF dưới dạng nhiều volume (cắt tại ranh giới file) kèm manifest JSON.
+    Trả về (total_pages, số volume)
+    """
+    log_section("TẠO FULL PDF THEO VOLUME")
+
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        log_error("Chưa cài đặt pypdf (cần cho chế độ volume)!")
+        log_info("Vui lòng cài đặt: pip install pypdf")
+        return None, None
+
+    fontName = register_fonts()
+    duplicates = duplicates or {}
+
+    work_dir = os.path.join(directory, CHECKPOINT_DIR_NAME)
+    os.makedirs(work_dir, exist_ok=True)
+    manifest = load_checkpoint_manifest(work_dir)
+
+    # Bước 1: Render theo shard thành fragment (dùng chung checkpoint với chế độ 4)
+    log_info("Bước 1: Render theo shard...")
+    start_time = time.time()
+    with memory_stage("VOLUME: render fragment"):
+        pages_info, stats = render_fragments(directory, code_files, duplicates, work_dir, manifest, fontName)
+    cleanup_fragments(work_dir, manifest, pages_info)
+    total_pages = pages_info[-1]['end_page'] if pages_info else 0
+    log_success(f"Hoàn thành render fragment ({time.time() - start_time:.2f}s)")
+    log_info(f"Dùng lại {stats['reused']}/{len(code_files)} file từ checkpoint", 1)
+
+    # Bước 2: Chia volume và ghi song song
+    volumes = split_volumes(pages_info, max_pages, max_bytes, get_footer_overhead(fontName, total_pages))
+
+    # Xóa volume thừa của lần chạy trước nếu lần này ít volume hơn
+    manifest_path = os.path.join(output_dir, VOLUME_MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            old_volumes = json.load(f).get('volumes', [])
+        for volume in old_volumes[len(volumes):]:
+            old_path = os.path.join(output_dir, volume['output'])
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    log_info(f"Bước 2: Ghi {len(volumes)} volume (tổng {total_pages} trang)...")
+    start_time = time.time()
+    with memory_stage("VOLUME: ghi volume"):
+        write_volumes(output_dir, volumes, total_pages, fontName)
+        if max_bytes:
+            volumes = enforce_volume_bytes(output_dir, volumes, total_pages, fontName, max_bytes)
+    log_success(f"Hoàn thành ghi volume ({time.time() - start_time:.2f}s)")
+
+    save_volume_manifest(manifest_path, directory, fontName, total_pages, volumes, duplicates)
+    for number, infos in enumerate(volumes, 1):
+        log_info(f"Volume {number}: trang {infos[0]['start_page']}-{infos[-1]['end_page']}, "
+                 f"{len(infos)} files", 1)
+    log_info(f"Manifest: {manifest_path}")
+
+    return total_pages, len(volumes)
+
+
+def regenerate_volume(output_dir, directory, volume_number):
+    """
+    Tạo lại một volume theo manifest, không đụng tới các volume khác.
+    Số trang của từng file phải giữ nguyên, nếu không cần tạo lại toàn bộ. Trả về True nếu thành công
+    """
+    log_section(f"TẠO LẠI VOLUME {volume_number}")
+
+    manifest_path = os.path.join(output_dir, VOLUME_MANIFEST_NAME)
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        volume_manifest = json.load(f)
+
+    entries = [entry for entry in volume_manifest['files'] if entry['volume'] == volume_number]
+    if not entries:
+        log_error(f"Không có volume {volume_number} trong manifest")
+        return False
+
+    # Mọi file trong manifest phải còn trên đĩa (file trùng và số trang phụ thuộc vào toàn bộ danh sách)
+    missing = [entry['path'] for entry in volume_manifest['files']
+               if not os.path.isfile(os.path.join(directory, entry['path']))]
+    if missing:
+        for path in missing:
+            log_error(f"Không tìm thấy file trong manifest: {path}", 1)
+        log_error("Source đã thay đổi, cần tạo lại toàn bộ volume")
+        return False
+
+    fontName = register_fonts()
+    work_dir = os.path.join(directory, CHECKPOINT_DIR_NAME)
+    os.makedirs(work_dir, exist_ok=True)
+    manifest = load_checkpoint_manifest(work_dir)
+
+    # Dựng lại danh sách file theo manifest; shard không đổi được dùng lại từ checkpoint
+    code_files = [os.path.join(directory, entry['path']) for entry in volume_manifest['files']]
+    duplicates = {os.path.join(directory, entry['path']): os.path.join(directory, entry['duplicate_of'])
+                  for entry in volume_manifest['files'] if entry['duplicate_of']}
+    current = {info['file_path']: info
+               for info in render_fragments(directory, code_files, duplicates, work_dir, manifest, fontName)[0]}
+
+    pages_info = []
+    for entry in entries:
+        info = current[os.path.join(directory, entry['path'])]
+        page_count = entry['end_page'] - entry['start_page'] + 1
+        if info['page_count'] != page_count:
+            log_error(f"{entry['path']}: số trang đổi {page_count} → {info['page_count']}, "
+                      f"cần tạo lại toàn bộ volume")
+            return False
+
+        # Giữ số trang theo manifest để footer khớp với các volume khác
+        pages_info.append(dict(info, start_page=entry['start_page'], end_page=entry['end_page']))
+        entry['key'] = info['key']
+
+    write_volumes(output_dir, [pages_info], volume_manifest['total_pages'], fontName, [volume_number])
+
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(volume_manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return True
+
+
+class ThrottledReader:
+    """
+    File object chỉ đọc, giả lập file share chậm: dữ liệu được tải theo block,
+    mỗi block chưa có trong cache tốn latency + block_size / bytes_per_second
+    """
+
+    def __init__(self, path, bytes_per_second, latency=LINEARIZE_BENCH_LATENCY, block_size=64 * 1024):
+        self._file = open(path, 'rb')
+        self._size = os.path.getsize(path)
+        self._position = 0
+        self._fetched_blocks = set()
+        self.bytes_per_second = bytes_per_second
+        self.latency = latency
+        self.block_size = block_size
+        self.bytes_read = 0
+
+    def _fetch(self, start, end):
+        for block in range(start // self.block_size, (max(end, start + 1) - 1) // self.block_size + 1):
+            if block in self._fetched_blocks:
+                continue
+            block_bytes = min(self.block_size, self._size - block * self.block_size)
+            time.sleep(self.latency + block_bytes / self.bytes_per_second)
+            self._fetched_blocks.add(block)
+            self.bytes_read += block_bytes
+
+    def read(self, size=-1):
+        end = self._size if size is None or size < 0 else min(self._position + size, self._size)
+        if end <= self._position:
+            return b''
+        self._fetch(self._position, end)
+        self._file.seek(self._position)
+        data = self._file.read(end - self._position)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = max(offset, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_first_page(stream):
+    """Mở PDF bằng pypdf và nạp toàn bộ object của trang 1 (content, font, ảnh...), trả về số object đã nạp"""
+    from pypdf import PdfReader
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+    seen = set()
+
+    def load(obj):
+        if isinstance(obj, IndirectObject):
+            if (obj.idnum, obj.generation) in seen:
+                return
+            seen.add((obj.idnum, obj.generation))
+            obj = obj.get_object()
+        if isinstance(obj, StreamObject):
+            obj.get_data()
+        if isinstance(obj, DictionaryObject):
+            for key, value in obj.items():
+                # Không đi ngược lên cây trang
+                if key not in ('/Parent', '/P'):
+                    load(value)
+        elif isinstance(obj, ArrayObject):
+            for value in obj:
+                load(value)
+
+    # Đi thẳng xuống trang đầu qua /Kids[0] như trình xem PDF, không duyệt cả cây trang
+    node = PdfReader(stream, strict=True).trailer['/Root']['/Pages']
+    while node.get('/Type') == '/Pages':
+        node = node['/Kids'][0].get_object()
+    load(node)
+    return len(seen)
+
+
+def measure_first_page_time(pdf_path, bytes_per_second=LINEARIZE_BENCH_RATE):
+    """
+    Đo thời gian mở PDF và nạp xong các object của trang 1 khi đọc qua ThrottledReader.
+    Trả về (giây, số bytes đã tải)
+    """
+    start_time = time.time()
+    with ThrottledReader(pdf_path, bytes_per_second) as reader:
+        load_first_page(reader)
+        return time.time() - start_time, reader.bytes_read
+
+
+def linearize_pdf(pdf_path, benchmark=False):
+    """
+    Ghi lại PDF ở dạng linearized (fast web view): object trang đầu và hint table nằm đầu file.
+    Chỉ sắp xếp lại object, không đổi nội dung trang/footer. Dùng pikepdf, nếu không có thì gọi qpdf.
+    Bước này là tùy chọn: lỗi chỉ được log, file gốc giữ nguyên. Trả về True nếu thành công
+    """
+    log_section("LINEARIZE PDF (FAST WEB VIEW)")
+    start_time = time.time()
+    tmp_path = pdf_path + '.linearized.tmp'
+
+    try:
+        try:
+            import pikepdf
+        except ImportError:
+            pikepdf = None
+
+        if pikepdf is not None:
+            with pikepdf.open(pdf_path) as pdf:
+                pdf.save(tmp_path, linearize=True)
+        else:
+            qpdf = shutil.which('qpdf')
+            if qpdf is None:
+                log_error("Chưa cài đặt pikepdf hoặc qpdf (cần cho linearize)!")
+                log_info("Vui lòng cài đặt: pip install pikepdf")
+                return False
+            # qpdf trả về 3 khi chỉ có cảnh báo
+            result = subprocess.run([qpdf, '--linearize', pdf_path, tmp_path], capture_output=True, text=True)
+            if result.returncode not in (0, 3):
+                raise RuntimeError(f"qpdf lỗi: {result.stderr.strip()}")
+
+        log_success(f"Hoàn thành linearize ({time.time() - start_time:.2f}s)")
+
+        if benchmark:
+            rate_mb = LINEARIZE_BENCH_RATE / (1024 * 1024)
+            log_info(f"Đo time-to-first-page qua reader giới hạn {rate_mb:.1f} MB/s...")
+            try:
+                before, before_bytes = measure_first_page_time(pdf_path)
+                after, after_bytes = measure_first_page_time(tmp_path)
+                log_info(f"Bản thường:     {before:.2f}s ({before_bytes / 1024:.0f} KB phải tải)", 1)
+                log_info(f"Bản linearized: {after:.2f}s ({after_bytes / 1024:.0f} KB phải tải)", 1)
+            except ImportError:
+                log_warning("Chưa cài đặt pypdf, bỏ qua đo time-to-first-page", 1)
+            except Exception as e:
+                log_warning(f"Không đo được time-to-first-page: {e}", 1)
+
+        os.replace(tmp_path, pdf_path)
+
+    except Exception as e:
+        log_error(f"Không thể linearize PDF, giữ nguyên bản gốc: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    file_size = os.path.getsize(pdf_path) / (1024 * 1024)  # MB
+    log_info(f"File size: {file_size:.2f} MB")
+    return True
+
+
+def create_shortened_direct(output_path, directory, code_files, pages_per_section=PAGES_PER_SECTION,
+                            duplicates=None):
+    """Tạo SHORTENED PDF trực tiếp từ bố cục ước lượng, không cần build bản FULL"""
+    log_section("TẠO SHORTENED PDF (TRỰC TIẾP)")
+
+    fontName = register_fonts()
+
+    # Bước 1: Ước lượng trang và chọn khoảng dòng
+    log_info("Bước 1: Ước lượng bố cục trang...")
+    with memory_stage("SHORTENED: ước lượng bố cục"):
+        pages_info = estimate_layout(directory, code_files, fontName, duplicates)
+    total_pages = pages_info[-1]['end_page'] if pages_info else 0
+    start_pages = {info['file_path']: info['start_page'] for info in pages_info}
+
+    if total_pages <= pages_per_section * 3:
+        log_info(f"Ước lượng chỉ có {total_pages} trang (≤ {pages_per_section * 3}) → giữ toàn bộ")
+        needed_pages = set(range(1, total_pages + 1))
+    else:
+        needed_pages, middle_start = get_section_pages(total_pages, pages_per_section)
+        log_info(f"Trang cần giữ lại:")
+        log_info(f"  • Đầu: 1-{pages_per_section}", 1)
+        log_info(f"  • Giữa: {middle_start}-{middle_start + pages_per_section - 1}", 1)
+        log_info(f"  • Cuối: {total_pages - pages_per_section + 1}-{total_pages}", 1)
+
+    slices = select_page_slices(pages_info, needed_pages)
+    page_mapping = {n: item['original_page'] for n, item in enumerate(slices, 1)}
+    log_info(f"Chọn {len(slices)} trang từ {len({item['file_index'] for item in slices})} files")
+
+    # Bước 2: Render chỉ các khoảng dòng đã chọn
+    log_info("Bước 2: Render PDF...")
+    start_time = time.time()
+
+    try:
+        with memory_stage("SHORTENED: story render"):
+            story = build_slice_story(directory, code_files, fontName, slices, start_pages)
+
+        def on_page(canvas_obj, doc_obj):
+            check_memory_budget()
+            draw_footer(canvas_obj, doc_obj, page_mapping, total_pages, fontName, is_shortened=True)
+
+        final_doc = create_doc_template(output_path, 'real', on_page)
+        with memory_stage("SHORTENED: build render"), memory_build_stages(final_doc, directory, story):
+            final_doc.build(story)
+
+        elapsed = time.time() - start_time
+        file_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
+        log_success(f"Hoàn thành render PDF ({elapsed:.2f}s)")
+        log_info(f"File size: {file_size:.2f} MB")
+        log_info(f"Output: {output_path}")
+
+    except MemoryBudgetExceeded:
+        raise
+    except Exception as e:
+        log_error(f"Lỗi khi render PDF: {e}")
+        log_error(f"Traceback: {traceback.format_exc()}")
+        raise
+
+    if duplicates:
+        page_counts = {info['file_path']: info['page_count'] for info in pages_info}
+        report_duplicates(directory, duplicates, page_counts, elapsed / max(len(slices), 1))
+
+    return total_pages
+
+
+def iter_preview_pages(directory, pages_info, start_pages):
+    """Sinh từng trang preview: (số trang, danh sách dòng text)"""
+    for info in pages_info:
+        path = info['file_path']
+        rel_path = os.path.relpath(path, directory)
+        lines = []
+        if not info['duplicate_of']:
+            try:
+                lines, _ = read_source_lines(path)
+            except Exception as e:
+                log_error(f"Không thể đọc file {rel_path}: {e}", 1)
+
+        for offset, line_range in enumerate(info['page_lines']):
+            page_text = []
+            if offset == 0:
+                page_text.append(f"📄 {rel_path}")
+                if info['duplicate_of']:
+                    original_rel = os.path.relpath(info['duplicate_of'], directory)
+                    page_text.append(f"♻️ Nội dung giống hệt {original_rel}, "
+                                     f"trang {start_pages.get(info['duplicate_of'])}")
+                elif info['truncated']:
+                    page_text.append(f"⚠️ File bị cắt ngắn, chỉ hiển thị {MAX_LINES_PER_FILE} dòng đầu")
+            if line_range:
+                first, last = line_range
+                for line_no in range(first, last + 1):
+                    page_text.append(format_code_line(lines[line_no - 1], line_no))
+            yield info['start_page'] + offset, page_text
+
+
+def create_preview(output_path, directory, code_files, duplicates=None, output_format='html'):
+    """Tạo bản xem trước phân trang (text/HTML) theo cùng quy tắc chia trang với PDF"""
+    log_section(f"TẠO PREVIEW ({output_format.upper()})")
+    start_time = time.time()
+
+    fontName = register_fonts()
+    pages_info = estimate_layout(directory, code_files, fontName, duplicates)
+    total_pages = pages_info[-1]['end_page'] if pages_info else 0
+    start_pages = {info['file_path']: info['start_page'] for info in pages_info}
+    pages = iter_preview_pages(directory, pages_info, start_pages)
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        if output_format == 'html':
+            f.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Source Code Preview</title>\n"
+                    "<style>body{background:#ddd;font-family:'Times New Roman',serif}"
+                    ".page{background:#fff;width:180mm;min-height:247mm;margin:10mm auto;padding:25mm 15mm;"
+                    "position:relative}.page pre{white-space:pre-wrap;font-family:inherit;font-size:12pt;"
+                    "line-height:13pt;margin:0}.page h2{font-size:14pt;margin:0 0 8pt}"
+                    ".footer{position:absolute;right:15mm;bottom:15mm;font-size:10pt}</style></head><body>\n")
+
+            # Mục lục: trang bắt đầu của từng file
+            f.write("<div class=\"page\"><h2>Mục lục</h2><pre>")
+            for info in pages_info:
+                rel_path = html.escape(os.path.relpath(info['file_path'], directory))
+                f.write(f"<a href=\"#page-{info['start_page']}\">{info['start_page']:>5}  {rel_path}</a>\n")
+            f.write("</pre></div>\n")
+
+            for page_number, page_text in pages:
+                f.write(f"<div class=\"page\" id=\"page-{page_number}\">")
+                body = page_text
+                if page_text and page_text[0].startswith("📄 "):
+                    f.write(f"<h2>{html.escape(page_text[0])}</h2>")
+                    body = page_text[1:]
+                f.write("<pre>" + "\n".join(html.escape(line) for line in body) + "</pre>")
+                f.write(f"<div class=\"footer\">{page_number}/{total_pages}</div></div>\n")
+            f.write("</body></html>\n")
+        else:
+            f.write("MỤC LỤC\n")
+            for info in pages_info:
+                f.write(f"{info['start_page']:>5}  {os.path.relpath(info['file_path'], directory)}\n")
+
+            for page_number, page_text in pages:
+                # Mỗi trang bắt đầu bằng form feed để dễ in/đối chiếu
+                f.write("\f\n" + "\n".join(page_text) + "\n")
+                f.write(f"{'':>60}{page_number}/{total_pages}\n")
+
+    elapsed = time.time() - start_time
+    log_success(f"Hoàn thành preview: {total_pages} trang, {len(code_files)} files ({elapsed:.2f}s)")
+    log_info(f"Output: {output_path}")
+    return total_pages
+
+
+def main():
+    global memory_profiler, source_archive
+    
+    log_section("SOURCE CODE TO PDF CONVERTER")
+    log_info(f"Start time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    
+    # Kiểm tra thư viện
+    try:
+        from reportlab.lib.pagesizes import A4
+        log_success("Thư viện reportlab đã sẵn sàng")
     except ImportError:
         log_error("Chưa cài đặt reportlab!")
         log_info("Vui lòng cài đặt: pip install reportlab")
         return
 
     # Nhập đường dẫn
-    directory = input("\n📁 Nhập đường dẫn thư mục chứa source code: ").strip()
+    directory = input("\n📁 Nhập đường dẫn thư mục chứa source code (hoặc file .zip/.tar.gz): ").strip()
     
-    if not os.path.isdir(directory):
+    if os.path.isdir(directory):
+        output_dir = directory
+        log_success(f"Thư mục hợp lệ: {directory}")
+    elif is_source_archive(directory):
+        # Đọc thẳng từ archive, output ghi cạnh file archive
+        try:
+            source_archive = SourceArchive(directory)
+        except (OSError,) + ARCHIVE_READ_ERRORS as e:
+            log_error(f"Không thể đọc archive {directory}: {e}")
+            return
+        directory = source_archive.archive_path
+        output_dir = os.path.dirname(directory)
+        log_success(f"Archive hợp lệ: {directory} ({len(source_archive.members)} files, không giải nén)")
+    else:
         log_error(f"Thư mục không tồn tại: {directory}")
         return
     
-    log_success(f"Thư mục hợp lệ: {directory}")
+    # Đo bộ nhớ (tùy chọn)
+    response = input("\n📊 Bật đo bộ nhớ từng bước/từng file? (y/n): ").strip().lower()
+    if response == 'y':
+        detailed = input("Đo chi tiết bằng tracemalloc? (chậm hơn 10-20 lần) (y/n): ").strip().lower()
+        budget = input("Giới hạn bộ nhớ (MB, Enter = không giới hạn): ").strip()
+        memory_profiler = MemoryProfiler(
+            os.path.join(output_dir, MEMORY_REPORT_NAME),
+            budget_mb=float(budget) if budget else None,
+            use_tracemalloc=detailed == 'y'
+        )
+        memory_profiler.start()
     
     # Hiển thị cấu hình lọc hiện tại
     log_info("Cấu hình lọc file:")
@@ -753,7 +2631,11 @@ def main():
     
     # Tìm kiếm files
     log_section("TÌM KIẾM FILE CODE")
-    code_files = get_all_code_files(directory)
+    with memory_stage("Tìm kiếm file"):
+        if source_archive is not None:
+            code_files = get_archive_code_files(source_archive)
+        else:
+            code_files = get_all_code_files(directory)
     
     if not code_files:
         log_error("Không tìm thấy file code nào!")
@@ -784,42 +2666,140 @@ def main():
     log_info("Danh sách file (tối đa 10 file đầu):")
     for i, file in enumerate(code_files[:10], 1):
         rel_path = os.path.relpath(file, directory)
-        file_size = os.path.getsize(file) / 1024  # KB
+        file_size = get_source_size(file) / 1024  # KB
         log_info(f"  {i:2}. {rel_path} ({file_size:.1f} KB)", 1)
     if len(code_files) > 10:
         log_info(f"  ... và {len(code_files) - 10} file khác", 1)
     
+    # Kiểm tra file trùng nội dung (chỉ in 1 lần)
+    with memory_stage("Kiểm tra file trùng"):
+        duplicates = find_duplicate_files(code_files)
+    
     # Ước tính thời gian
     estimated_time = len(code_files) * 0.5  # Ước tính 0.5s mỗi file
     log_info(f"\n⏱️  Ước tính thời gian xử lý: {estimated_time/60:.1f} phút")
     
+    # Chọn chế độ xuất
+    log_info("\nChế độ xuất:")
+    log_info("1. Full + Shortened (mặc định)")
+    log_info("2. Chỉ Shortened (ước lượng trang, không build bản Full - nhanh)")
+    log_info("3. Xem trước phân trang (HTML/text, không tạo PDF)")
+    log_info("4. Full + Shortened có checkpoint (chạy lại sẽ tiếp tục nếu bị dừng)")
+    log_info("5. Watch mode (tự cập nhật bản Full khi file code thay đổi)")
+    log_info("6. Full chia thành nhiều volume (giới hạn số trang hoặc MB mỗi volume)")
+    mode = input("\nLựa chọn (1/2/3/4/5/6): ").strip()
+    
+    if mode in ('4', '5', '6') and source_archive is not None:
+        # Checkpoint/watch/volume cần thư mục trên đĩa để theo dõi và lưu fragment
+        log_warning("Checkpoint, watch mode và volume chỉ hỗ trợ thư mục, chuyển sang chế độ 1")
+        mode = '1'
+    
+    linearize = False
+    benchmark_linearize = False
+    if mode not in ('2', '3', '5', '6'):
+        response = input("⚡ Linearize bản Full (fast web view, cần pikepdf hoặc qpdf)? (y/n): ").strip().lower()
+        linearize = response == 'y'
+        if linearize:
+            response = input("Đo time-to-first-page trước/sau linearize? (y/n): ").strip().lower()
+            benchmark_linearize = response == 'y'
+    
+    if mode == '3':
+        output_format = input("Định dạng preview (html/txt): ").strip().lower()
+        output_format = 'txt' if output_format == 'txt' else 'html'
+        output_path_preview = os.path.join(output_dir, f"SourceCode_Preview.{output_format}")
+        with memory_stage("Preview"):
+            create_preview(output_path_preview, directory, code_files, duplicates, output_format)
+        log_info(f"End time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        return
+    
     response = input("\n🚀 Bắt đầu tạo PDF? (y/n): ").strip().lower()
     if response != 'y':
         log_info("Đã hủy")
         return
     
     try:
+        if mode == '2':
+            output_path_shortened = os.path.join(output_dir, "SourceCode_Shortened.pdf")
+            total_pages = create_shortened_direct(output_path_shortened, directory, code_files,
+                                                  duplicates=duplicates)
+            
+            log_section("KẾT QUẢ SHORTENED VERSION")
+            log_success(f"Đã lưu: {output_path_shortened}")
+            log_info(f"Tổng số trang ước lượng của bản Full: {total_pages}")
+            log_info(f"End time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            return
+        
+        if mode == '6':
+            manifest_path = os.path.join(output_dir, VOLUME_MANIFEST_NAME)
+            if os.path.exists(manifest_path):
+                while True:
+                    volume = input("Chỉ tạo lại một volume theo manifest? (số volume / Enter = tạo tất cả): ").strip()
+                    if not volume or volume.isdigit():
+                        break
+                    log_error(f"Số volume không hợp lệ: {volume}")
+                if volume:
+                    regenerate_volume(output_dir, directory, int(volume))
+                    log_info(f"End time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+                    return
+            
+            while True:
+                limit = input("Giới hạn mỗi volume (vd: 500 = 500 trang, 50MB = 50 MB): ").strip()
+                try:
+                    max_pages, max_bytes = parse_volume_limit(limit)
+                    break
+                except ValueError:
+                    log_error(f"Giới hạn không hợp lệ: {limit} (nhập số trang hoặc số MB, vd: 500 / 50MB)")
+            
+            total_pages, volume_count = create_pdf_volumes(output_dir, directory, code_files, duplicates,
+                                                           max_pages, max_bytes)
+            if total_pages is None:
+                return
+            
+            log_section("KẾT QUẢ VOLUME")
+            log_success(f"Đã lưu {volume_count} volume vào: {output_dir}")
+            log_info(f"Tổng số trang: {total_pages}")
+            log_info(f"End time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            return
+        
+        if mode == '5':
+            output_path_full = os.path.join(output_dir, "SourceCode_Full.pdf")
+            watch_and_rebuild(output_path_full, directory, code_files, duplicates)
+            log_info(f"Output: {output_path_full}")
+            log_info(f"End time: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            return
+        
         # 1. Tạo PDF FULL
-        output_path_full = os.path.join(directory, "SourceCode_Full.pdf")
+        output_path_full = os.path.join(output_dir, "SourceCode_Full.pdf")
         
-        total_pages = create_pdf_document(output_path_full, directory, code_files)
+        if mode == '4':
+            total_pages, pages_info = create_pdf_resumable(output_path_full, directory, code_files, duplicates)
+            if total_pages is None:
+                return
+        else:
+            total_pages = create_pdf_document(output_path_full, directory, code_files, duplicates=duplicates)
+            pages_info = None
         
         if total_pages is None:
             log_warning("Đã hủy tạo PDF do file quá lớn")
             return
         
+        if linearize:
+            with memory_stage("Linearize"):
+                linearize_pdf(output_path_full, benchmark_linearize)
+        
         log_section("KẾT QUẢ FULL VERSION")
         log_success(f"Đã lưu: {output_path_full}")
         log_info(f"Tổng số trang: {total_pages}")
         
         # 2. Tạo PDF SHORTENED nếu cần
         if total_pages > PAGES_PER_SECTION * 3:
-            pages_info = count_pages_per_file(directory, code_files, register_fonts())
+            if pages_info is None:
+                pages_info = count_pages_per_file(directory, code_files, register_fonts(), duplicates)
             selected_files, page_mapping = select_files_for_shortened(
                 pages_info, total_pages, PAGES_PER_SECTION
             )
             
-            output_path_shortened = os.path.join(directory, "SourceCode_Shortened.pdf")
+            output_path_shortened = os.path.join(output_dir, "SourceCode_Shortened.pdf")
             
             create_pdf_document(
                 output_path_shortened, 
@@ -828,7 +2808,8 @@ def main():
                 is_shortened=True,
                 file_indices=selected_files,
                 page_mapping=page_mapping,
-                total_pages_original=total_pages
+                total_pages_original=total_pages,
+                duplicates=duplicates
             )
             
             log_section("KẾT QUẢ SHORTENED VERSION")
@@ -848,9 +2829,17 @@ def main():
         
     except KeyboardInterrupt:
         log_warning("\n\n⚠️  Người dùng đã dừng chương trình (Ctrl+C)")
+        if mode in ('4', '5', '6'):
+            log_info(f"Checkpoint đã lưu tại: {os.path.join(directory, CHECKPOINT_DIR_NAME)}")
+            log_info("→ Chạy lại với cùng thư mục để tiếp tục từ file đã xong")
         log_info("Đang dọn dẹp...")
         sys.exit(1)
         
+    except MemoryBudgetExceeded as e:
+        log_error(f"\n\n🧠 {e}")
+        log_info("Đã dừng để tránh bị hệ điều hành kill (OOM), xem báo cáo bộ nhớ bên dưới")
+        sys.exit(1)
+        
     except Exception as e:
         log_error(f"\n\n💥 Lỗi nghiêm trọng: {str(e)}")
         log_error("Traceback đầy đủ:")
@@ -863,6 +2852,13 @@ if __name__ == "__main__":
         main()
     except KeyboardInterrupt:
         print(f"\n{Colors.WARNING}⚠️  Chương trình bị dừng bởi người dùng{Colors.ENDC}")
+    except MemoryBudgetExceeded as e:
+        print(f"\n{Colors.FAIL}🧠 {e}{Colors.ENDC}")
     except Exception as e:
         print(f"\n{Colors.FAIL}💥 Lỗi không xử lý được: {e}{Colors.ENDC}")
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
+    finally:
+        if memory_profiler is not None:
+            memory_profiler.finish()
+        if source_archive is not None:
+            source_archive.close()
\ No newline at end of file
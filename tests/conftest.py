@@ -0,0 +1,45 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ['var', 'int', 'Foo', 'Bar', 'await', 'public', 'static', 'class', 'new', '=>',
+         'if', 'else', 'baz_qux', 'return']
+
+
+def write_code_file(path, seed, line_count):
+    """File .cs giả: dòng ngắn, dòng nhiều từ, dòng nối bằng \\xa0, chuỗi dài không có khoảng trắng và token dài hơn một trang"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(line_count):
+        r = rng.random()
+        if r < 0.1:
+            literal = ''.join(rng.choice('abcdefXYZ0123456789') for _ in range(rng.randint(150, 700)))
+            lines.append(f'    var s = "{literal}";')
+        elif r < 0.2:
+            lines.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))))
+        elif r < 0.22:
+            lines.append('x' * rng.randint(2000, 6000))
+        elif r < 0.3:
+            # Khoảng trắng không ngắt (\xa0) hay gặp trong text copy vào .cshtml/C#
+            lines.append('\xa0'.join(rng.choice(WORDS) for _ in range(rng.randint(20, 90))))
+        else:
+            lines.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def long_token_tree(tmp_path):
+    """Cây nhỏ có token dài không ngắt được và dòng bị cắt qua trang; trả về (thư mục, danh sách file)"""
+    core = tmp_path / 'Core'
+    core.mkdir()
+    files = []
+    for seed in range(3):
+        path = str(core / f'Long{seed}.cs')
+        write_code_file(path, seed, 300)
+        files.append(path)
+    return str(tmp_path), files
@@ -0,0 +1,88 @@
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+import doc_python
+
+MEMBERS = {
+    'proj/Core/Order.cs': 'public class Order\n{\n    int Id;\n}\n',
+    'proj/Core/Copy/Order.cs': 'public class Order\n{\n    int Id;\n}\n',
+    'proj/Views/Home.cshtml': '<h1>Trang\xa0chủ</h1>\n',
+    'proj/bin/Debug/Order.cs': 'class Build {}\n',
+    'proj/Core/Form.Designer.cs': 'partial class Form {}\n',
+    'proj/Core/notes.txt': 'không phải code\n',
+}
+
+
+def write_archive(tmp_path, kind, members=MEMBERS):
+    if kind == 'zip':
+        path = str(tmp_path / 'proj.zip')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, text in members.items():
+                archive.writestr(name, text.encode('utf-8'))
+    else:
+        source_dir = tmp_path / 'src'
+        for name, text in members.items():
+            (source_dir / name).parent.mkdir(parents=True, exist_ok=True)
+            (source_dir / name).write_text(text, encoding='utf-8')
+        path = str(tmp_path / 'proj.tar.gz')
+        with tarfile.open(path, 'w:gz') as archive:
+            archive.add(str(source_dir / 'proj'), arcname='proj')
+    return path
+
+
+@pytest.fixture(params=['zip', 'tar.gz'])
+def archive(request, tmp_path, monkeypatch):
+    archive = doc_python.SourceArchive(write_archive(tmp_path, request.param))
+    monkeypatch.setattr(doc_python, 'source_archive', archive)
+    yield archive
+    archive.close()
+
+
+def test_archive_filters_and_reads_members(archive):
+    """Lọc member theo VALID_EXTENSIONS / EXCLUDED_DIRS / EXCLUDED_PATTERNS và đọc nội dung không cần giải nén"""
+    code_files = doc_python.get_archive_code_files(archive)
+    member_paths = sorted(os.path.relpath(path, archive.archive_path).replace(os.sep, '/') for path in code_files)
+    assert member_paths == ['proj/Core/Copy/Order.cs', 'proj/Core/Order.cs', 'proj/Views/Home.cshtml']
+
+    for path in code_files:
+        member = os.path.relpath(path, archive.archive_path).replace(os.sep, '/')
+        assert ''.join(doc_python.read_source_text(path)) == MEMBERS[member]
+        assert doc_python.get_source_size(path) == len(MEMBERS[member].encode('utf-8'))
+
+    # Bản gốc là member xuất hiện trước trong archive (thứ tự zip và tar có thể khác nhau)
+    duplicates = doc_python.find_duplicate_files(code_files)
+    assert [set(pair) for pair in duplicates.items()] == [{
+        os.path.join(archive.archive_path, 'proj', 'Core', 'Order.cs'),
+        os.path.join(archive.archive_path, 'proj', 'Core', 'Copy', 'Order.cs'),
+    }]
+
+
+def test_corrupt_zip_member_is_skipped(tmp_path, monkeypatch):
+    """Member zip hỏng được báo bằng OSError và bỏ qua khi tìm file trùng, không làm dừng cả lượt chạy"""
+    members = {'proj/A.cs': 'x' * 4000 + '\n', 'proj/B.cs': 'y' * 4000 + '\n', 'proj/C.cs': 'x' * 4000 + '\n'}
+    path = str(tmp_path / 'proj.zip')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+        for name, text in members.items():
+            archive.writestr(name, text)
+
+    # Sửa một byte dữ liệu của B.cs → sai CRC khi đọc
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    data[data.index(b'y' * 100)] = ord('z')
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    archive = doc_python.SourceArchive(path)
+    monkeypatch.setattr(doc_python, 'source_archive', archive)
+    broken = os.path.join(archive.archive_path, 'proj', 'B.cs')
+    with pytest.raises(OSError):
+        doc_python.read_source_text(broken)
+
+    code_files = sorted(archive.members)
+    duplicates = doc_python.find_duplicate_files(code_files)
+    assert duplicates == {os.path.join(archive.archive_path, 'proj', 'C.cs'):
+                          os.path.join(archive.archive_path, 'proj', 'A.cs')}
+    archive.close()
@@ -0,0 +1,59 @@
+import pytest
+
+import doc_python
+from conftest import write_code_file
+
+
+def test_resume_rerenders_only_unfinished_shards(tmp_path, monkeypatch):
+    """Bị ngắt ở shard thứ 3 → chạy lại chỉ render các shard chưa xong, kết quả giống build thường"""
+    PdfReader = pytest.importorskip('pypdf').PdfReader
+    directory = tmp_path / 'src'
+    directory.mkdir()
+    code_files = []
+    for i in range(10):
+        path = str(directory / f'File{i}.cs')
+        write_code_file(path, seed=i, line_count=30)
+        code_files.append(path)
+
+    # Shard nhỏ (tối đa 4 file) để 10 file chắc chắn chia thành ít nhất 3 shard
+    monkeypatch.setattr(doc_python, 'CHECKPOINT_SHARD_FILES', 2)
+    shards = doc_python.split_shards(str(directory), code_files)
+    assert len(shards) >= 3
+
+    render_shard_fragment = doc_python.render_shard_fragment
+    calls = []
+
+    def interrupted_render(*args, **kwargs):
+        calls.append(args[2])
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return render_shard_fragment(*args, **kwargs)
+
+    output_path = str(tmp_path / 'full.pdf')
+    monkeypatch.setattr(doc_python, 'render_shard_fragment', interrupted_render)
+    with pytest.raises(KeyboardInterrupt):
+        doc_python.create_pdf_resumable(output_path, str(directory), code_files)
+
+    render_fragments = doc_python.render_fragments
+    results = []
+
+    def recorded_render_fragments(*args, **kwargs):
+        results.append(render_fragments(*args, **kwargs))
+        return results[-1]
+
+    monkeypatch.setattr(doc_python, 'render_shard_fragment', render_shard_fragment)
+    monkeypatch.setattr(doc_python, 'render_fragments', recorded_render_fragments)
+    total_pages, _ = doc_python.create_pdf_resumable(output_path, str(directory), code_files)
+
+    finished_files = len(shards[0]) + len(shards[1])
+    _, stats = results[0]
+    assert stats['reused'] == finished_files
+    assert stats['rendered_files'] == len(code_files) - finished_files
+
+    normal_path = str(tmp_path / 'normal.pdf')
+    assert doc_python.create_pdf_document(normal_path, str(directory), code_files) == total_pages
+    # Footer của bản checkpoint được vẽ sau nên thứ tự text trong trang khác, so theo tập dòng
+    for number, (page, normal_page) in enumerate(zip(PdfReader(output_path).pages,
+                                                     PdfReader(normal_path).pages), 1):
+        assert sorted(page.extract_text().splitlines()) == sorted(normal_page.extract_text().splitlines()), \
+            f"trang {number}"
@@ -0,0 +1,55 @@
+import pytest
+from reportlab.platypus import Paragraph
+
+import doc_python
+
+
+@pytest.fixture(scope='module')
+def styles():
+    return doc_python.create_styles(doc_python.register_fonts())
+
+
+@pytest.mark.parametrize('line', [
+    'x' * 3000,
+    'var s = "' + 'abc123' * 120 + '";',
+    'if Foo ' + 'y' * 400 + ' else Bar ' + 'z' * 900 + ' return',
+    ' '.join(['baz_qux'] * 90),
+    '@Html.Raw("\xa0\xa0")  ' + 'Foo\xa0' * 200,
+    '\xa0\xa0 if ' + 'y' * 400 + '\xa0z ' * 50,
+], ids=['token-dai', 'chuoi-dai', 'tron-lan', 'nhieu-tu', 'nbsp', 'nbsp-token-dai'])
+def test_count_wrapped_lines_matches_paragraph(styles, line):
+    """Số dòng ước lượng khớp với Paragraph, kể cả token dài hơn cả dòng (splitLongWords) và \\xa0"""
+    code_style = styles['code_style']
+    width, _ = doc_python.get_frame_content_size()
+    batch = ['int a;\n', line + '\n', 'return;\n']
+
+    paragraph = Paragraph(doc_python.format_code_batch(batch, 1), code_style)
+    paragraph.wrap(width, 1e9)
+
+    estimated = sum(
+        doc_python.count_wrapped_lines(doc_python.format_code_line(text, i), code_style.fontName,
+                                       code_style.fontSize, width, code_style.spaceShrinkage)
+        for i, text in enumerate(batch, 1)
+    )
+    assert estimated == len(paragraph.blPara.lines)
+
+
+def test_shortened_pages_match_full_pages(long_token_tree, tmp_path):
+    """Mỗi trang của bản Shortened (dựng trực tiếp) giống hệt trang gốc tương ứng của bản Full"""
+    PdfReader = pytest.importorskip('pypdf').PdfReader
+    directory, code_files = long_token_tree
+    full_path = str(tmp_path / 'full.pdf')
+    shortened_path = str(tmp_path / 'shortened.pdf')
+
+    total_pages = doc_python.create_pdf_document(full_path, directory, code_files)
+    estimated_total = doc_python.create_shortened_direct(shortened_path, directory, code_files,
+                                                         pages_per_section=3)
+    assert estimated_total == total_pages
+
+    full_pages = [page.extract_text() for page in PdfReader(full_path).pages]
+    shortened_pages = [page.extract_text() for page in PdfReader(shortened_path).pages]
+    needed_pages, _ = doc_python.get_section_pages(total_pages, 3)
+
+    assert len(shortened_pages) == len(needed_pages)
+    for original_page, text in zip(sorted(needed_pages), shortened_pages):
+        assert text == full_pages[original_page - 1], f"trang gốc {original_page}"
@@ -0,0 +1,39 @@
+import os
+
+import doc_python
+from conftest import write_code_file
+
+
+def test_build_memory_is_attributed_per_file(tmp_path, monkeypatch):
+    """Mỗi file có bản ghi bộ nhớ riêng cho từng lượt doc.build, không chỉ lúc tạo Paragraph"""
+    directory = tmp_path / 'src'
+    directory.mkdir()
+    code_files = []
+    for i in range(2):
+        path = str(directory / f'Long{i}.cs')
+        write_code_file(path, seed=i, line_count=40)
+        code_files.append(path)
+    small = str(directory / 'Small.cs')
+    with open(small, 'w', encoding='utf-8') as f:
+        f.write('int a;\n')
+    code_files.append(small)
+
+    profiler = doc_python.MemoryProfiler(str(tmp_path / 'memory.json'), use_tracemalloc=True)
+    monkeypatch.setattr(doc_python, 'memory_profiler', profiler)
+    profiler.start()
+    try:
+        doc_python.create_pdf_document(str(tmp_path / 'full.pdf'), str(directory), code_files)
+    finally:
+        profiler.finish()
+    assert not profiler._stack
+
+    peaks = {}
+    for record in profiler.records:
+        if record['kind'] == 'file':
+            peaks.setdefault(record['name'], {})[record['parent']] = record['peak_bytes']
+    for path in code_files:
+        assert {'FULL: build đếm trang', 'FULL: build render'} <= set(peaks[os.path.basename(path)])
+
+    # Layout trong doc.build của file dài phải nặng hơn hẳn file một dòng
+    for path in code_files[:-1]:
+        assert peaks[os.path.basename(path)]['FULL: build render'] > 5 * peaks['Small.cs']['FULL: build render']
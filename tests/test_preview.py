@@ -0,0 +1,52 @@
+import os
+import re
+import shutil
+
+import pytest
+
+import doc_python
+
+
+def get_numbered_range(text):
+    """(dòng đầu, dòng cuối) của các dòng code có đánh số "NNN | " trong text, None nếu không có"""
+    numbers = [int(n) for n in re.findall(r'(?m)^(\d{3,}) \|', text)]
+    return (min(numbers), max(numbers)) if numbers else None
+
+
+def get_pdf_page_lines(pdf_path):
+    """(dòng đầu, dòng cuối) của các dòng code có đánh số trên từng trang PDF, None nếu không có"""
+    PdfReader = pytest.importorskip('pypdf').PdfReader
+    return [get_numbered_range(page.extract_text()) for page in PdfReader(pdf_path).pages]
+
+
+def test_preview_page_boundaries_match_pdf(long_token_tree, tmp_path):
+    """Khoảng dòng và footer từng trang của preview khớp với PDF build thật"""
+    directory, code_files = long_token_tree
+    # Thêm một file trùng để kiểm tra cả trang tham chiếu
+    copy_dir = os.path.join(directory, 'Copy')
+    os.makedirs(copy_dir)
+    duplicate = os.path.join(copy_dir, 'Dup0.cs')
+    shutil.copyfile(code_files[0], duplicate)
+    code_files = code_files + [duplicate]
+    duplicates = doc_python.find_duplicate_files(code_files)
+    assert duplicates == {duplicate: code_files[0]}
+
+    pdf_path = str(tmp_path / 'full.pdf')
+    total_pages = doc_python.create_pdf_document(pdf_path, directory, code_files, duplicates=duplicates)
+    pages_info = doc_python.estimate_layout(directory, code_files, doc_python.register_fonts(), duplicates)
+
+    estimated = [line_range for info in pages_info for line_range in info['page_lines']]
+    actual = get_pdf_page_lines(pdf_path)
+    assert len(estimated) == total_pages
+    for page_number, (expected, got) in enumerate(zip(actual, estimated), 1):
+        assert got == expected, f"trang {page_number}"
+
+    # File txt preview: mỗi trang sau form feed, footer "x/total" ở cuối trang
+    preview_path = str(tmp_path / 'preview.txt')
+    doc_python.create_preview(preview_path, directory, code_files, duplicates, output_format='txt')
+    with open(preview_path, encoding='utf-8') as f:
+        preview_pages = f.read().split('\f')[1:]
+    assert len(preview_pages) == total_pages
+    for page_number, (expected, text) in enumerate(zip(actual, preview_pages), 1):
+        assert get_numbered_range(text) == expected, f"preview trang {page_number}"
+        assert text.rstrip().endswith(f"{page_number}/{total_pages}")
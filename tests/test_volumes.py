@@ -0,0 +1,95 @@
+import json
+import os
+
+import pytest
+
+import doc_python
+from conftest import write_code_file
+
+
+@pytest.mark.parametrize('limit, expected', [
+    ('500', (500, None)),
+    (' 50mb ', (None, 50 * 1024 * 1024)),
+    ('0.5MB', (None, 0.5 * 1024 * 1024)),
+])
+def test_parse_volume_limit(limit, expected):
+    assert doc_python.parse_volume_limit(limit) == expected
+
+
+@pytest.mark.parametrize('limit', ['', 'abc', '50GB', 'MB', '0', '-3', '1.5', 'nanMB', 'infMB'])
+def test_parse_volume_limit_rejects_invalid(limit):
+    with pytest.raises(ValueError):
+        doc_python.parse_volume_limit(limit)
+
+
+def test_regenerate_volume_reports_missing_file(tmp_path):
+    """File trong manifest bị xóa → log lỗi và trả về False, không đụng tới volume đã có"""
+    pytest.importorskip('pypdf')
+    directory = tmp_path / 'src'
+    directory.mkdir()
+    code_files = []
+    for i in range(3):
+        path = str(directory / f'File{i}.cs')
+        write_code_file(path, seed=i, line_count=40)
+        code_files.append(path)
+
+    output_dir = str(tmp_path / 'out')
+    os.makedirs(output_dir)
+    total_pages, volume_count = doc_python.create_pdf_volumes(output_dir, str(directory), code_files, max_pages=1)
+    assert total_pages and volume_count > 1
+
+    volume_path = os.path.join(output_dir, doc_python.VOLUME_FILE_PATTERN.format(1))
+    with open(volume_path, 'rb') as f:
+        before = f.read()
+
+    os.remove(code_files[-1])
+    assert doc_python.regenerate_volume(output_dir, str(directory), 1) is False
+    with open(volume_path, 'rb') as f:
+        assert f.read() == before
+
+
+@pytest.fixture
+def volume_tree(tmp_path):
+    """24 file nhỏ, đủ để một volume chứa nhiều file dưới giới hạn dung lượng"""
+    directory = tmp_path / 'src'
+    directory.mkdir()
+    code_files = []
+    for i in range(24):
+        path = str(directory / f'File{i:02d}.cs')
+        write_code_file(path, seed=i, line_count=30)
+        code_files.append(path)
+    output_dir = str(tmp_path / 'out')
+    os.makedirs(output_dir)
+    return str(directory), code_files, output_dir
+
+
+def get_volume_sizes(output_dir):
+    with open(os.path.join(output_dir, doc_python.VOLUME_MANIFEST_NAME), encoding='utf-8') as f:
+        volumes = json.load(f)['volumes']
+    return [(volume['file_count'], os.path.getsize(os.path.join(output_dir, volume['output'])))
+            for volume in volumes]
+
+
+@pytest.mark.parametrize('underestimate', [False, True], ids=['uoc-luong', 'chia-lai-sau-khi-ghi'])
+def test_volumes_respect_max_bytes(volume_tree, monkeypatch, underestimate):
+    """Mọi volume nhiều file đều không vượt max_bytes, kể cả khi ước lượng dung lượng sai"""
+    pytest.importorskip('pypdf')
+    directory, code_files, output_dir = volume_tree
+    max_bytes = 0.15 * 1024 * 1024
+    if underestimate:
+        # Ước lượng bằng 0 → tất cả dồn vào một volume, phải được chia lại theo dung lượng thật
+        monkeypatch.setattr(doc_python, 'get_fragment_costs',
+                            lambda pages_info: {info['fragment']: (0, [0] * 1000) for info in pages_info})
+        monkeypatch.setattr(doc_python, 'get_footer_overhead', lambda fontName, total_pages: 0)
+
+    total_pages, volume_count = doc_python.create_pdf_volumes(output_dir, directory, code_files,
+                                                              max_bytes=max_bytes)
+    sizes = get_volume_sizes(output_dir)
+    assert len(sizes) == volume_count > 1
+    assert any(file_count > 1 for file_count, _ in sizes)
+    for number, (file_count, size) in enumerate(sizes, 1):
+        assert file_count == 1 or size <= max_bytes, f"volume {number}: {size} bytes, {file_count} files"
+
+    PdfReader = pytest.importorskip('pypdf').PdfReader
+    assert sum(len(PdfReader(os.path.join(output_dir, doc_python.VOLUME_FILE_PATTERN.format(number))).pages)
+               for number in range(1, volume_count + 1)) == total_pages